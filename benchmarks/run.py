@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+CDK和下载路径的基准测试
+
+    python benchmarks/run.py --cdks 1000000 --duration 10 --output result.json
+    python benchmarks/run.py --baseline baseline.json --max-regression 0.2
+    python benchmarks/run.py compare result.json baseline.json
+
+在临时目录中准备SQLite数据库（指定数量的CDK）和下载文件，以子进程启动应用，
+依次执行各项负载，输出JSON格式的吞吐量和延迟分位数。指定--baseline时与
+基准结果比较，吞吐量下降或p99延迟上升超过阈值时以非0状态退出。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from workloads import WORKLOADS, DEFAULT_ORDER
+
+
+class Context:
+    """各负载共享的状态"""
+
+    def __init__(self, host, port, timeout, unused_codes, file_size, generate_batch):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.file_size = file_size
+        self.generate_batch = generate_batch
+        # 兑换成功的设备，供查询和下载负载使用
+        self.devices = []
+        # 未使用的CDK由各个兑换负载共同消耗，每个只兑换一次
+        self._codes = iter(unused_codes)
+        self._codes_lock = threading.Lock()
+
+    def next_code(self):
+        """取出一个未使用的CDK，用完时返回None"""
+        with self._codes_lock:
+            return next(self._codes, None)
+
+
+def seed(workdir, cdks, file_size, redeem_pool):
+    """准备数据库和下载文件，返回(数据库URL, 文件目录, 用于兑换的CDK列表)
+
+    工作目录中已有数据库时只补足缺少的CDK，便于重复使用大数据集。
+    """
+    database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    files_dir = os.path.join(workdir, 'files')
+    os.makedirs(files_dir, exist_ok=True)
+
+    from sqlalchemy import select
+    from src.models.cdk_store import create_cdks, read_cdk_counters
+    from src.models.schema import cdks as table, ensure_schema
+    from src.models.storage import create_db_engine
+
+    engine = create_db_engine(database_url)
+    ensure_schema(engine)
+    total, used = read_cdk_counters(engine)
+    unused = total - used
+    if unused < cdks:
+        started = time.perf_counter()
+
+        def report(done):
+            print(f'  已生成 {done}/{cdks - unused}', file=sys.stderr)
+
+        create_cdks(engine, cdks - unused, on_chunk=report)
+        print(f'生成CDK用时 {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    with engine.connect() as connection:
+        codes = connection.execute(
+            select(table.c.cdk_code).where(table.c.is_used == False).limit(redeem_pool)
+        ).scalars().all()
+    engine.dispose()
+
+    path = os.path.join(files_dir, 'bench.zip')
+    if not os.path.exists(path) or os.path.getsize(path) != file_size:
+        with open(path, 'wb') as f:
+            remaining = file_size
+            while remaining > 0:
+                block = os.urandom(min(remaining, 1024 * 1024))
+                f.write(block)
+                remaining -= len(block)
+    return database_url, files_dir, codes
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, workers, threads, database_url, files_dir, log_path):
+    """以子进程启动应用并等待就绪"""
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        FILES_DIR=files_dir,
+        PORT=str(port),
+        # 基准测试从单个IP发出大量请求，关闭限流
+        RATE_LIMIT_IP_PER_MINUTE='0',
+        RATE_LIMIT_DEVICE_PER_MINUTE='0',
+    )
+    if mode == 'server':
+        command = [sys.executable, os.path.join(ROOT, 'src', 'server.py'), '--host', '127.0.0.1',
+                   '--port', str(port), '--workers', str(workers), '--threads', str(threads)]
+    elif mode == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'src.asgi:app', '--host', '127.0.0.1',
+                   '--port', str(port), '--log-level', 'warning']
+    else:
+        command = [sys.executable, os.path.join(ROOT, 'src', 'main.py')]
+    log = open(log_path, 'w')
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=log)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'应用启动失败，日志见 {log_path}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/admin/api/stats', timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'应用启动超时，日志见 {log_path}')
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def run_workload(workload, concurrency, duration):
+    """在concurrency个线程中持续发送请求duration秒，返回统计结果"""
+    latencies = []
+    errors = [0]
+    transferred = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        local_latencies = []
+        local_errors = 0
+        local_bytes = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                ok, size = workload.request()
+            except StopIteration:
+                break
+            except OSError:
+                ok, size = False, 0
+            local_latencies.append(time.perf_counter() - started)
+            local_bytes += size
+            if not ok:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+            transferred[0] += local_bytes
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'duration': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'bytes_per_second': round(transferred[0] / elapsed) if elapsed else 0,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            'p50': _ms(percentile(latencies, 0.50)),
+            'p90': _ms(percentile(latencies, 0.90)),
+            'p99': _ms(percentile(latencies, 0.99)),
+            'max': _ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def _ms(value):
+    return round(value * 1000, 3) if value is not None else None
+
+
+def compare(result, baseline, max_regression):
+    """与基准结果比较，返回退化项列表"""
+    regressions = []
+    for name, current in result['workloads'].items():
+        base = baseline.get('workloads', {}).get(name)
+        if not base:
+            continue
+        if base['throughput'] and current['throughput'] < base['throughput'] * (1 - max_regression):
+            regressions.append(
+                f"{name}: 吞吐量 {current['throughput']}/s，基准 {base['throughput']}/s"
+            )
+        base_p99 = base['latency_ms']['p99']
+        current_p99 = current['latency_ms']['p99']
+        if base_p99 and current_p99 and current_p99 > base_p99 * (1 + max_regression):
+            regressions.append(f'{name}: p99延迟 {current_p99}ms，基准 {base_p99}ms')
+    return regressions
+
+
+def report_comparison(result, baseline_path, max_regression):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(result, baseline, max_regression)
+    for line in regressions:
+        print(f'性能退化 {line}', file=sys.stderr)
+    if not regressions:
+        print(f'与基准相比没有超过 {max_regression:.0%} 的性能退化', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cdk-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    names = args.workloads.split(',') if args.workloads else DEFAULT_ORDER
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        sys.exit(f"未知的负载: {', '.join(unknown)}")
+
+    print(f'准备数据 ({args.cdks} 个CDK) 于 {workdir}', file=sys.stderr)
+    database_url, files_dir, codes = seed(workdir, args.cdks, args.file_size, args.redeem_pool)
+
+    port = args.port or free_port()
+    process = start_server(args.server, port, args.workers, args.threads,
+                           database_url, files_dir, os.path.join(workdir, 'server.log'))
+    context = Context('127.0.0.1', port, args.timeout, codes, args.file_size, args.generate_batch)
+    result = {
+        'meta': {
+            'cdks': args.cdks,
+            'server': args.server,
+            'workers': args.workers,
+            'threads': args.threads,
+            'duration': args.duration,
+            'file_size': args.file_size,
+            'sqlite_journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+            'sqlite_synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'workloads': {},
+    }
+    try:
+        for name in names:
+            workload = WORKLOADS[name](context)
+            concurrency = workload.concurrency or args.concurrency
+            print(f'执行 {name} (并发 {concurrency})', file=sys.stderr)
+            result['workloads'][name] = run_workload(workload, concurrency, args.duration)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+    if args.baseline:
+        return report_comparison(result, args.baseline, args.max_regression)
+    return 0
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        parser = argparse.ArgumentParser(description='比较两次基准测试结果')
+        parser.add_argument('command')
+        parser.add_argument('result', help='本次结果JSON')
+        parser.add_argument('baseline', help='基准结果JSON')
+        parser.add_argument('--max-regression', type=float, default=0.2, help='允许的退化比例')
+        args = parser.parse_args()
+        with open(args.result, encoding='utf-8') as f:
+            result = json.load(f)
+        sys.exit(report_comparison(result, args.baseline, args.max_regression))
+
+    parser = argparse.ArgumentParser(description='CDK和下载路径的基准测试')
+    parser.add_argument('--cdks', type=int, default=100000, help='数据库中未使用的CDK数量')
+    parser.add_argument('--workloads', help=f"逗号分隔的负载（默认 {','.join(DEFAULT_ORDER)}）")
+    parser.add_argument('--duration', type=float, default=10, help='每项负载的持续时间（秒）')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发请求数')
+    parser.add_argument('--server', choices=['server', 'asgi', 'main'], default='server',
+                        help='启动方式：src/server.py、ASGI（需要uvicorn）或src/main.py')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='工作进程数')
+    parser.add_argument('--threads', type=int, default=32, help='每个工作进程的并发请求数')
+    parser.add_argument('--port', type=int, help='端口（默认随机）')
+    parser.add_argument('--file-size', type=int, default=10 * 1024 * 1024, help='下载文件大小（字节）')
+    parser.add_argument('--redeem-pool', type=int, default=100000, help='用于兑换负载的CDK数量')
+    parser.add_argument('--generate-batch', type=int, default=100, help='生成负载每次请求的CDK数量')
+    parser.add_argument('--timeout', type=float, default=60, help='单个请求的超时（秒）')
+    parser.add_argument('--workdir', help='工作目录（指定时保留，可重复使用已生成的数据）')
+    parser.add_argument('--output', help='结果JSON文件')
+    parser.add_argument('--baseline', help='基准结果JSON，与之比较')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='允许的退化比例')
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+基准测试的各项负载
+
+每个负载的request()发送一次请求，返回(是否成功, 响应体字节数)。
+"""
+import http.client
+import json
+import random
+
+
+class Workload:
+    name = None
+    # 默认并发数，为None时使用命令行指定的并发数
+    concurrency = None
+
+    def __init__(self, context):
+        self.context = context
+
+    def _request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection(
+            self.context.host, self.context.port, timeout=self.context.timeout
+        )
+        try:
+            headers = dict(headers or {})
+            if body is not None:
+                body = json.dumps(body).encode()
+                headers['Content-Type'] = 'application/json'
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            size = 0
+            while True:
+                data = response.read(256 * 1024)
+                if not data:
+                    break
+                size += len(data)
+            return response.status, size
+        finally:
+            connection.close()
+
+
+class RedeemWorkload(Workload):
+    """用未使用的CDK兑换，每个CDK绑定一个新设备"""
+
+    name = 'redeem'
+
+    def request(self):
+        code = self.context.next_code()
+        if code is None:
+            raise StopIteration
+        device_id = f'bench-{code}'
+        status, size = self._request('POST', '/api/verify_cdk', {'cdk': code, 'device_id': device_id})
+        if status == 200:
+            self.context.devices.append(device_id)
+        return status == 200, size
+
+
+class CheckWorkload(Workload):
+    """查询设备授权状态，已授权和未授权的设备各占一半"""
+
+    name = 'check'
+
+    def request(self):
+        devices = self.context.devices
+        if devices and random.random() < 0.5:
+            device_id = random.choice(devices)
+        else:
+            device_id = f'unknown-{random.getrandbits(64):x}'
+        status, size = self._request('POST', '/api/check_device', {'device_id': device_id})
+        return status == 200, size
+
+
+class DownloadWorkload(Workload):
+    """已授权设备下载默认文件"""
+
+    name = 'download'
+
+    def request(self):
+        if not self.context.devices:
+            raise StopIteration
+        device_id = random.choice(self.context.devices)
+        status, size = self._request('GET', '/api/download_file', headers={'Device-ID': device_id})
+        return status == 200 and size == self.context.file_size, size
+
+
+class MixedWorkload(Workload):
+    """兑换（写入）和查询未授权设备（不命中缓存的读取）各占一半
+
+    用于比较SQLite日志模式等设置对读写并发的影响。
+    """
+
+    name = 'mixed'
+
+    def __init__(self, context):
+        super().__init__(context)
+        self._redeem = RedeemWorkload(context)
+
+    def request(self):
+        if random.random() < 0.5:
+            return self._redeem.request()
+        device_id = f'unknown-{random.getrandbits(64):x}'
+        status, size = self._request('POST', '/api/check_device', {'device_id': device_id})
+        return status == 200, size
+
+
+class StatsWorkload(Workload):
+    name = 'stats'
+
+    def request(self):
+        status, size = self._request('GET', '/admin/api/stats')
+        return status == 200, size
+
+
+class GenerateWorkload(Workload):
+    """每次请求生成一批CDK"""
+
+    name = 'generate'
+    concurrency = 2
+
+    def request(self):
+        status, size = self._request('POST', '/api/generate_cdk', {'count': self.context.generate_batch})
+        return status == 200, size
+
+
+class ExportWorkload(Workload):
+    """流式导出全部未使用的CDK"""
+
+    name = 'export'
+    concurrency = 1
+
+    def request(self):
+        status, size = self._request('GET', '/admin/api/export?format=txt')
+        return status == 200, size
+
+
+WORKLOADS = {
+    workload.name: workload
+    for workload in (
+        RedeemWorkload, CheckWorkload, MixedWorkload, DownloadWorkload,
+        StatsWorkload, GenerateWorkload, ExportWorkload,
+    )
+}
+# 默认执行顺序：兑换产生的设备供后面的查询和下载使用
+DEFAULT_ORDER = ['redeem', 'check', 'mixed', 'download', 'stats', 'generate', 'export']
@@ -7,136 +7,166 @@ CDK生成和管理脚本
 import os
 import sys
 import argparse
-import secrets
-import string
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # 添加项目路径
 sys.path.insert(0, os.path.dirname(__file__))
 
-from flask import Flask
-from src.models.user import db
-from src.models.cdk import CDK
+# 只使用SQLAlchemy Core，不加载Flask应用
+from sqlalchemy import func, select
+from src.models.schema import ensure_schema, files
+from src.models.storage import create_db_engine
+from src.models.cdk_store import (
+    create_cdks, count_used_cdks, stream_export, list_cdks_page, read_cdk_counters, reconcile_cdk_counters,
+    cleanup_used_cdks, EXPORT_FORMATS, ARCHIVE_MODES, LIST_PAGE_SIZE, MAX_LIST_PAGE_SIZE
+)
 
-def create_app():
-    """创建Flask应用实例"""
-    app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'src', 'database', 'app.db')}"
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    db.init_app(app)
-    return app
+# 生成数量不超过该值时打印每个CDK
+PRINT_CODES_LIMIT = 1000
+# 导出文件的写缓冲大小
+EXPORT_BUFFER_SIZE = 1024 * 1024
 
-def generate_cdk_code():
-    """生成随机CDK码"""
-    return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(16))
+def get_engine():
+    """按DATABASE_URL创建数据库引擎（与应用相同的配置），数据库结构版本变化时先建表和迁移"""
+    engine = create_db_engine()
+    ensure_schema(engine)
+    return engine
 
-def generate_cdks(count):
-    """生成指定数量的CDK"""
-    app = create_app()
+def generate_cdks(count, file_ids=None):
+    """生成指定数量的CDK，指定file_ids时只能下载这些文件"""
+    engine = get_engine()
     
-    with app.app_context():
-        # 确保数据库表存在
-        db.create_all()
-        
-        generated_cdks = []
-        
-        for i in range(count):
-            # 生成唯一的CDK码
-            while True:
-                cdk_code = generate_cdk_code()
-                existing = CDK.query.filter_by(cdk_code=cdk_code).first()
-                if not existing:
-                    break
-            
-            # 创建新的CDK记录
-            new_cdk = CDK(cdk_code=cdk_code)
-            db.session.add(new_cdk)
-            generated_cdks.append(cdk_code)
-            
-            print(f"生成CDK {i+1}/{count}: {cdk_code}")
-        
-        try:
-            db.session.commit()
-            print(f"\n成功生成 {count} 个CDK码！")
-            return generated_cdks
-        except Exception as e:
-            db.session.rollback()
-            print(f"生成CDK时发生错误: {e}")
+    if file_ids:
+        file_ids = sorted(set(file_ids))
+        with engine.connect() as connection:
+            found = connection.execute(
+                select(func.count()).select_from(files).where(files.c.id.in_(file_ids))
+            ).scalar()
+        if found != len(file_ids):
+            print("指定的文件不存在")
             return []
+    
+    def report(done):
+        print(f"已生成 {done}/{count}")
+    
+    try:
+        # 数量较少时逐个打印生成的CDK
+        inserted, generated_cdks = create_cdks(
+            engine, count, return_codes=count <= PRINT_CODES_LIMIT, on_chunk=report,
+            file_ids=file_ids
+        )
+    except Exception as e:
+        print(f"生成CDK时发生错误: {e}")
+        return []
+    
+    for cdk_code in generated_cdks:
+        print(cdk_code)
+    print(f"\n成功生成 {inserted} 个CDK码！")
+    return generated_cdks
 
-def list_cdks():
-    """列出所有CDK"""
-    app = create_app()
+def list_cdks(status=None, page_size=LIST_PAGE_SIZE):
+    """分页列出CDK"""
+    engine = get_engine()
     
-    with app.app_context():
-        cdks = CDK.query.order_by(CDK.created_at.desc()).all()
-        
-        if not cdks:
-            print("数据库中没有CDK记录")
-            return
-        
-        print(f"\n共找到 {len(cdks)} 个CDK:")
-        print("-" * 80)
-        print(f"{'CDK码':<20} {'状态':<10} {'设备ID':<20} {'创建时间':<20} {'使用时间':<20}")
-        print("-" * 80)
-        
+    cdks, cursor = list_cdks_page(engine, limit=page_size, status=status)
+    
+    if not cdks:
+        print("数据库中没有CDK记录")
+        return
+    
+    print("-" * 80)
+    print(f"{'CDK码':<20} {'状态':<10} {'设备ID':<20} {'创建时间':<20} {'使用时间':<20}")
+    print("-" * 80)
+    
+    total = 0
+    while True:
         for cdk in cdks:
-            status = "已使用" if cdk.is_used else "未使用"
-            device_id = cdk.device_id[:16] + "..." if cdk.device_id and len(cdk.device_id) > 16 else (cdk.device_id or "")
-            created_at = cdk.created_at.strftime("%Y-%m-%d %H:%M") if cdk.created_at else ""
-            used_at = cdk.used_at.strftime("%Y-%m-%d %H:%M") if cdk.used_at else ""
-            
-            print(f"{cdk.cdk_code:<20} {status:<10} {device_id:<20} {created_at:<20} {used_at:<20}")
+            status_text = "已使用" if cdk['is_used'] else "未使用"
+            device_id = cdk['device_id'] or ""
+            if len(device_id) > 16:
+                device_id = device_id[:16] + "..."
+            created_at = cdk['created_at'][:16].replace('T', ' ') if cdk['created_at'] else ""
+            used_at = cdk['used_at'][:16].replace('T', ' ') if cdk['used_at'] else ""
+                
+            print(f"{cdk['cdk_code']:<20} {status_text:<10} {device_id:<20} {created_at:<20} {used_at:<20}")
+        total += len(cdks)
+        
+        if cursor is None:
+            break
+        cdks, cursor = list_cdks_page(engine, cursor=cursor, limit=page_size, status=status)
+    
+    print(f"\n共列出 {total} 个CDK")
 
-def export_cdks(filename):
+def export_cdks(filename, fmt=None):
     """导出CDK到文件"""
-    app = create_app()
+    engine = get_engine()
     
-    with app.app_context():
-        cdks = CDK.query.filter_by(is_used=False).all()
-        
-        if not cdks:
-            print("没有未使用的CDK可以导出")
-            return
+    if fmt is None:
+        # 根据扩展名推断导出格式
+        ext = os.path.splitext(filename)[1].lstrip('.').lower()
+        fmt = ext if ext in EXPORT_FORMATS else 'txt'
+    
+    total, used = read_cdk_counters(engine)
+    total -= used
+    
+    if not total:
+        print("没有未使用的CDK可以导出")
+        return
+    
+    try:
+        with open(filename, 'w', encoding='utf-8', buffering=EXPORT_BUFFER_SIZE) as f:
+            f.writelines(stream_export(engine, fmt, total))
         
-        try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write("# CDK码列表\n")
-                f.write(f"# 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"# 总数量: {len(cdks)}\n\n")
-                
-                for cdk in cdks:
-                    f.write(f"{cdk.cdk_code}\n")
-            
-            print(f"成功导出 {len(cdks)} 个未使用的CDK到文件: {filename}")
-        except Exception as e:
-            print(f"导出CDK时发生错误: {e}")
+        print(f"成功导出 {total} 个未使用的CDK到文件: {filename}")
+    except Exception as e:
+        print(f"导出CDK时发生错误: {e}")
 
-def delete_used_cdks():
+def delete_used_cdks(older_than_days=None, archive=None, archive_file=None, assume_yes=False):
     """删除已使用的CDK"""
-    app = create_app()
+    engine = get_engine()
     
-    with app.app_context():
-        used_cdks = CDK.query.filter_by(is_used=True).all()
-        
-        if not used_cdks:
-            print("没有已使用的CDK需要删除")
-            return
-        
-        count = len(used_cdks)
+    older_than = None
+    if older_than_days is not None:
+        older_than = datetime.utcnow() - timedelta(days=older_than_days)
+    if archive == 'jsonl' and not archive_file:
+        archive_file = f"cdks_archive_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    
+    count = count_used_cdks(engine, older_than)
+    
+    if not count:
+        print("没有已使用的CDK需要删除")
+        return
+    
+    if not assume_yes:
         confirm = input(f"确定要删除 {count} 个已使用的CDK吗？(y/N): ")
-        
-        if confirm.lower() == 'y':
-            try:
-                for cdk in used_cdks:
-                    db.session.delete(cdk)
-                db.session.commit()
-                print(f"成功删除 {count} 个已使用的CDK")
-            except Exception as e:
-                db.session.rollback()
-                print(f"删除CDK时发生错误: {e}")
-        else:
+        if confirm.lower() != 'y':
             print("操作已取消")
+            return
+    
+    try:
+        removed = cleanup_used_cdks(engine, older_than=older_than, archive=archive, archive_file=archive_file)
+        print(f"成功删除 {removed} 个已使用的CDK")
+        if archive == 'table':
+            print("已归档到cdk_history表")
+        elif archive == 'jsonl':
+            print(f"已归档到文件: {archive_file}")
+    except Exception as e:
+        print(f"删除CDK时发生错误: {e}")
+
+def reconcile_stats():
+    """从cdks表重新统计计数器，检查偏差"""
+    engine = get_engine()
+    
+    with engine.begin() as connection:
+        old, (total, used) = reconcile_cdk_counters(connection)
+    
+    print(f"总数: {total}，已使用: {used}，未使用: {total - used}")
+    if old is None:
+        print("计数器已初始化")
+    elif old == (total, used):
+        print("计数器没有偏差")
+    else:
+        print(f"已修正计数器偏差: 总数 {old[0] - total:+d}，已使用 {old[1] - used:+d}")
 
 def main():
     parser = argparse.ArgumentParser(description='CDK生成和管理工具')
@@ -145,30 +175,44 @@ def main():
     # 生成CDK命令
     generate_parser = subparsers.add_parser('generate', help='生成CDK')
     generate_parser.add_argument('count', type=int, help='要生成的CDK数量')
+    generate_parser.add_argument('--file-id', type=int, action='append', dest='file_ids',
+                                 help='CDK可下载的文件ID，可重复指定（默认只能下载默认文件）')
     
     # 列出CDK命令
     list_parser = subparsers.add_parser('list', help='列出所有CDK')
+    list_parser.add_argument('--status', choices=['used', 'unused'], help='只列出已使用或未使用的CDK')
+    list_parser.add_argument('--page-size', type=int, default=MAX_LIST_PAGE_SIZE, help='每页读取的数量')
     
     # 导出CDK命令
     export_parser = subparsers.add_parser('export', help='导出未使用的CDK到文件')
     export_parser.add_argument('filename', help='导出文件名')
+    export_parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), help='导出格式（默认根据扩展名推断）')
     
     # 删除已使用CDK命令
     delete_parser = subparsers.add_parser('cleanup', help='删除已使用的CDK')
+    delete_parser.add_argument('--older-than', type=float, metavar='DAYS', help='只删除指定天数之前使用的CDK')
+    delete_parser.add_argument('--archive', choices=ARCHIVE_MODES, help='删除前归档到cdk_history表或JSONL文件')
+    delete_parser.add_argument('--archive-file', help='JSONL归档文件路径')
+    delete_parser.add_argument('-y', '--yes', action='store_true', help='跳过确认')
+    
+    # 重新统计计数器命令
+    subparsers.add_parser('reconcile', help='从数据库重新统计CDK计数器')
     
     args = parser.parse_args()
     
     if args.command == 'generate':
-        if args.count <= 0 or args.count > 1000:
-            print("CDK数量必须在1-1000之间")
+        if args.count <= 0:
+            print("CDK数量必须大于0")
             return
-        generate_cdks(args.count)
+        generate_cdks(args.count, args.file_ids)
     elif args.command == 'list':
-        list_cdks()
+        list_cdks(args.status, args.page_size)
     elif args.command == 'export':
-        export_cdks(args.filename)
+        export_cdks(args.filename, args.format)
     elif args.command == 'cleanup':
-        delete_used_cdks()
+        delete_used_cdks(args.older_than, args.archive, args.archive_file, args.yes)
+    elif args.command == 'reconcile':
+        reconcile_stats()
     else:
         parser.print_help()
 
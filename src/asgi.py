@@ -0,0 +1,205 @@
+"""
+ASGI入口，适合大量并发的慢速下载
+
+    uvicorn src.asgi:app --host 0.0.0.0 --port 5001
+
+路由和模型与WSGI模式完全相同：Flask视图（包括所有数据库访问）在线程池中
+执行；下载响应（FileRangeIterator）的文件内容则在事件循环中异步发送，
+等待慢速客户端和限速时不占用线程，一万个并发下载不需要一万个线程。
+uvicorn为可选依赖，只在使用此入口时需要安装。
+"""
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.main import app as flask_app
+from src.utils.ranged_file import FileRangeIterator
+
+# 执行Flask视图（及数据库访问）的线程数
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', '32'))
+# 读取下载文件的线程数
+ASGI_FILE_THREADS = int(os.environ.get('ASGI_FILE_THREADS', '8'))
+# 请求体超过该大小时缓存到临时文件
+BODY_SPOOL_SIZE = 1024 * 1024
+
+
+def _read_at(f, offset, size):
+    f.seek(offset)
+    return f.read(size)
+
+
+class WSGIAdapter:
+    """在ASGI服务器上运行WSGI应用，FileRangeIterator响应改为异步发送"""
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, file_threads=ASGI_FILE_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi-wsgi')
+        self.file_executor = ThreadPoolExecutor(file_threads, thread_name_prefix='asgi-file')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._handle_lifespan(receive, send)
+        else:
+            raise ValueError(f'不支持的连接类型: {scope["type"]}')
+
+    async def _handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                self.file_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle_http(self, scope, receive, send):
+        body = SpooledTemporaryFile(max_size=BODY_SPOOL_SIZE)
+        try:
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                more_body = message.get('more_body', False)
+            body.seek(0)
+
+            loop = asyncio.get_running_loop()
+            environ = self._environ(scope, body)
+            status, headers, app_iter = await loop.run_in_executor(
+                self.executor, self._call_wsgi, environ
+            )
+        finally:
+            body.close()
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(self._watch_disconnect(receive, disconnected))
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [
+                    (name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers
+                ],
+            })
+            if isinstance(app_iter, FileRangeIterator):
+                await self._send_file(app_iter, send, disconnected)
+            else:
+                await self._send_iterable(app_iter, send, disconnected)
+            if not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            watcher.cancel()
+            if hasattr(app_iter, 'close'):
+                await loop.run_in_executor(self.executor, app_iter.close)
+
+    def _call_wsgi(self, environ):
+        """在线程中执行WSGI应用，返回(状态, 响应头, 响应体)"""
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        app_iter = self.wsgi_app(environ, start_response)
+        return started[0], started[1], app_iter
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            if name in environ:
+                value = environ[name] + ',' + value
+            environ[name] = value
+        return environ
+
+    @staticmethod
+    async def _watch_disconnect(receive, disconnected):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    async def _send_file(self, body, send, disconnected):
+        """在事件循环中发送文件，读文件在线程池中进行，限速时异步等待"""
+        loop = asyncio.get_running_loop()
+        pacer = body.pacer
+        f = await loop.run_in_executor(self.file_executor, open, body.file_path, 'rb')
+        if pacer is not None:
+            pacer.start()
+        try:
+            for part in body.parts:
+                if isinstance(part, bytes):
+                    await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+                    continue
+                offset, stop = part
+                while offset < stop and not disconnected.is_set():
+                    data = await loop.run_in_executor(
+                        self.file_executor, _read_at, f, offset, min(body.chunk_size, stop - offset)
+                    )
+                    if not data:
+                        # 文件在传输过程中被截断
+                        return
+                    offset += len(data)
+                    if pacer is not None:
+                        wait = pacer.delay(len(data))
+                        if wait:
+                            await asyncio.sleep(wait)
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        finally:
+            f.close()
+            if pacer is not None:
+                pacer.finish()
+
+    async def _send_iterable(self, app_iter, send, disconnected):
+        """逐块在线程池中取出响应体（例如流式导出）并发送"""
+        loop = asyncio.get_running_loop()
+        iterator = iter(app_iter)
+        while not disconnected.is_set():
+            data = await loop.run_in_executor(self.executor, next, iterator, None)
+            if data is None:
+                return
+            if data:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+
+app = WSGIAdapter(flask_app)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('ASGI模式需要安装uvicorn: pip install uvicorn')
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5001)))
@@ -3,58 +3,95 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+from flask import Flask
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from src.models.user import db
 from src.models.cdk import CDK  # 导入CDK模型
+from src.models.schema import ensure_schema
+from src.models.storage import configure_engine, database_url, engine_options
 from src.routes.user import user_bp
 from src.routes.cdk import cdk_bp
 from src.routes.admin import admin_bp
+from src.utils.metrics import init_metrics
+from src.utils.profiler import init_profiler
+from src.utils.download_token import DEFAULT_SECRET_KEY, download_token_secret
+from src.utils.ranged_file import OFFLOAD_MODES
+from src.utils.static_assets import StaticManifest, serve_static
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
 # 配置
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
-app.config['FLASK_ENV'] = os.environ.get('FLASK_ENV', 'development')
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', DEFAULT_SECRET_KEY)
+# 下载令牌的签名密钥，未设置时使用SECRET_KEY；两者都未设置（或为默认值）时不使用下载令牌
+app.config['DOWNLOAD_TOKEN_SECRET'] = os.environ.get('DOWNLOAD_TOKEN_SECRET')
+if download_token_secret(app.config) is None:
+    app.logger.warning('未设置SECRET_KEY或DOWNLOAD_TOKEN_SECRET，下载令牌已禁用，只能通过Device-ID下载')
+app.config['FLASK_ENV'] = os.environ.get('FLASK_ENV', 'production')
 
 # 启用CORS支持
 CORS(app)
 
+# 部署在反向代理之后时，按代理层数从X-Forwarded-For中取真实客户端IP（用于限流）
+trusted_proxies = int(os.environ.get('TRUSTED_PROXY_COUNT', '0'))
+if trusted_proxies > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(cdk_bp, url_prefix='/api')
 app.register_blueprint(admin_bp, url_prefix='/admin')
 
+# 请求计数、耗时直方图和数据库查询耗时，通过/metrics导出
+init_metrics(app)
+
 # 数据库配置
 database_dir = os.path.join(os.path.dirname(__file__), 'database')
 os.makedirs(database_dir, exist_ok=True)
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(database_dir, 'app.db')}"
+# DATABASE_URL、连接池和SQLite PRAGMA见src/models/storage.py，与命令行工具共用
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['ARCHIVE_DIR'] = os.path.join(database_dir, 'archive')
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(database_dir, 'profiles'))
 db.init_app(app)
+# 按PROFILE_SAMPLE_RATE/PROFILE_TOKEN抽样分析请求，未配置时不注册钩子
+init_profiler(app)
+# 只在数据库结构版本变化时建表和迁移，平时启动只读取版本号
 with app.app_context():
-    db.create_all()
+    configure_engine(db.engine)
+    ensure_schema(db.engine)
 
 # 确保文件目录存在
-files_dir = os.path.join(os.path.dirname(__file__), 'files')
+files_dir = os.environ.get('FILES_DIR', os.path.join(os.path.dirname(__file__), 'files'))
 os.makedirs(files_dir, exist_ok=True)
+app.config['FILES_DIR'] = files_dir
+# 没有指定文件的CDK可下载的文件id，未设置时使用登记第一个文件时固定的默认文件（files.is_default）
+default_file_id = os.environ.get('DEFAULT_FILE_ID')
+app.config['DEFAULT_FILE_ID'] = int(default_file_id) if default_file_id else None
+# 下载发送方式：direct、x-accel（nginx）或x-sendfile（Apache/lighttpd）
+app.config['DOWNLOAD_OFFLOAD'] = os.environ.get('DOWNLOAD_OFFLOAD', 'direct').lower()
+if app.config['DOWNLOAD_OFFLOAD'] not in OFFLOAD_MODES:
+    raise ValueError(f"DOWNLOAD_OFFLOAD必须是{'、'.join(OFFLOAD_MODES)}之一")
+# x-accel模式下nginx internal location的前缀
+app.config['DOWNLOAD_ACCEL_PREFIX'] = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-files/')
+
+# 前端静态文件在启动时读入内存并预压缩，处理请求时不访问文件系统
+static_manifest = StaticManifest(app.static_folder)
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-            return "Static folder not configured", 404
+    if app.static_folder is None:
+        return "Static folder not configured", 404
 
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
-            return "index.html not found", 404
+    entry = static_manifest.lookup(path)
+    if entry is None:
+        return "index.html not found", 404
+    return serve_static(entry)
 
 
 if __name__ == '__main__':
+    # 单进程开发服务器，生产环境请使用src/server.py
     # 获取端口号，默认5001，生产环境通常使用环境变量PORT
     port = int(os.environ.get('PORT', 5001))
     debug = app.config['FLASK_ENV'] == 'development'
@@ -1,16 +1,88 @@
-from flask_sqlalchemy import SQLAlchemy
+import os
+import threading
+import time
+from collections import namedtuple
 from datetime import datetime
+from sqlalchemy import select, update
+from src.models.cdk_store import adjust_cdk_counters, read_auth_revision
+from src.models.schema import cdk_history, cdk_stats, cdks
 from src.models.user import db
+from src.models.file import CDKFile, read_default_file_id
+from src.utils.metrics import cdk_redemptions
+from src.utils.ttl_cache import TTLCache
+
+# 设备授权缓存：已授权结果缓存较久，未授权结果只短暂缓存
+AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', '300'))
+AUTH_CACHE_NEGATIVE_TTL = float(os.environ.get('AUTH_CACHE_NEGATIVE_TTL', '5'))
+device_auth_cache = TTLCache(
+    maxsize=int(os.environ.get('AUTH_CACHE_SIZE', '10000')),
+    ttl=AUTH_CACHE_TTL
+)
+# 检查其他进程（或命令行工具）是否撤销过设备授权的最小间隔（秒），
+# 清理CDK后其他进程最多在这段时间内仍使用缓存的授权
+AUTH_REVISION_CHECK_INTERVAL = float(os.environ.get('AUTH_REVISION_CHECK_INTERVAL', '1.0'))
+
+
+class AuthCacheSync:
+    """在多个进程之间同步设备授权缓存的失效
+
+    清理CDK时cdk_stats.auth_revision加1。每个进程最多每隔check_interval秒
+    读取一次该值，发现变化时清空本进程的缓存；查询期间修订号发生变化的
+    结果不写入缓存，避免清理前查到的授权在清空之后又被缓存。
+    """
+
+    def __init__(self, cache, check_interval=AUTH_REVISION_CHECK_INTERVAL):
+        self.cache = cache
+        self.check_interval = check_interval
+        self.revision = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        """必要时读取修订号并清空缓存，返回当前的修订号"""
+        now = time.monotonic()
+        checked_at = self._checked_at
+        if checked_at is not None and now - checked_at < self.check_interval:
+            return self.revision
+        with self._lock:
+            if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                revision = read_auth_revision(db.session.connection())
+                if revision != self.revision:
+                    self.cache.clear()
+                    self.revision = revision
+                self._checked_at = now
+            return self.revision
+
+    def set(self, revision, key, value, ttl=None):
+        """修订号仍为revision时才写入缓存"""
+        with self._lock:
+            if revision == self.revision:
+                self.cache.set(key, value, ttl)
+
+
+auth_cache_sync = AuthCacheSync(device_auth_cache)
+
+# 设备的下载权限：unrestricted表示设备绑定了没有指定文件的CDK（可下载默认文件），
+# file_ids为设备绑定的CDK授权的文件id，default_file_id为固定的默认文件id
+# （随授权一起缓存，下载时不需要再查询数据库）
+Entitlements = namedtuple('Entitlements', 'authorized unrestricted file_ids default_file_id')
+NOT_ENTITLED = Entitlements(False, False, frozenset(), None)
+
+# CDK兑换结果
+REDEEM_SUCCESS = 'success'
+REDEEM_ALREADY_BOUND = 'already_bound'
+REDEEM_WRONG_DEVICE = 'wrong_device'
+REDEEM_NOT_FOUND = 'not_found'
+
+REDEEM_MESSAGES = {
+    REDEEM_SUCCESS: 'CDK验证成功，设备已绑定',
+    REDEEM_ALREADY_BOUND: 'CDK已绑定当前设备',
+    REDEEM_WRONG_DEVICE: 'CDK已被其他设备使用',
+    REDEEM_NOT_FOUND: 'CDK不存在',
+}
 
 class CDK(db.Model):
-    __tablename__ = 'cdks'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    cdk_code = db.Column(db.String(32), unique=True, nullable=False)
-    is_used = db.Column(db.Boolean, nullable=False, default=False)
-    device_id = db.Column(db.String(128), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    used_at = db.Column(db.DateTime, nullable=True)
+    __table__ = cdks
 
     def __repr__(self):
         return f'<CDK {self.cdk_code}>'
@@ -25,34 +97,99 @@ class CDK(db.Model):
             'used_at': self.used_at.isoformat() if self.used_at else None
         }
 
-    def use_cdk(self, device_id):
-        """使用CDK并绑定设备"""
-        self.is_used = True
-        self.device_id = device_id
-        self.used_at = datetime.utcnow()
+    @staticmethod
+    def redeem(cdk_code, device_id):
+        """兑换CDK并绑定设备，返回兑换结果
+
+        使用单条条件UPDATE抢占未使用的CDK，多个进程并发兑换同一个CDK时
+        只有一个能成功。
+        """
+        result = db.session.execute(
+            update(CDK)
+            .where(CDK.cdk_code == cdk_code, CDK.is_used == False)
+            .values(is_used=True, device_id=device_id, used_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            adjust_cdk_counters(db.session.connection(), used=1)
         db.session.commit()
+        
+        if result.rowcount == 1:
+            device_auth_cache.invalidate(device_id)
+            return REDEEM_SUCCESS
+        
+        # 未抢占成功：CDK不存在或已被使用
+        row = db.session.execute(
+            select(CDK.device_id).where(CDK.cdk_code == cdk_code)
+        ).first()
+        if row is None:
+            return REDEEM_NOT_FOUND
+        if row.device_id == device_id:
+            return REDEEM_ALREADY_BOUND
+        return REDEEM_WRONG_DEVICE
 
     @staticmethod
     def verify_cdk(cdk_code, device_id):
         """验证CDK是否有效"""
-        cdk = CDK.query.filter_by(cdk_code=cdk_code).first()
-        
-        if not cdk:
-            return False, "CDK不存在"
-        
-        if cdk.is_used:
-            if cdk.device_id == device_id:
-                return True, "CDK已绑定当前设备"
-            else:
-                return False, "CDK已被其他设备使用"
+        outcome = CDK.redeem(cdk_code, device_id)
+        cdk_redemptions.inc(outcome)
+        is_valid = outcome in (REDEEM_SUCCESS, REDEEM_ALREADY_BOUND)
+        return is_valid, REDEEM_MESSAGES[outcome]
+
+    @staticmethod
+    def file_ids_for(cdk_code):
+        """返回CDK授权的文件id列表"""
+        return db.session.execute(
+            select(CDKFile.file_id)
+            .join(CDK, CDK.id == CDKFile.cdk_id)
+            .where(CDK.cdk_code == cdk_code)
+            .order_by(CDKFile.file_id)
+        ).scalars().all()
+
+    @staticmethod
+    def device_entitlements(device_id):
+        """查询设备可下载的文件，结果按设备缓存
+
+        通过device_id索引和cdk_files主键的一次左连接完成。
+        """
+        revision = auth_cache_sync.check()
+        entitlements = device_auth_cache.get(device_id)
+        if entitlements is not None:
+            return entitlements
         
-        # CDK未使用，绑定到当前设备
-        cdk.use_cdk(device_id)
-        return True, "CDK验证成功，设备已绑定"
+        rows = db.session.execute(
+            select(CDKFile.file_id)
+            .select_from(CDK)
+            .outerjoin(CDKFile, CDKFile.cdk_id == CDK.id)
+            .where(CDK.device_id == device_id, CDK.is_used == True)
+        ).all()
+        if rows:
+            file_ids = frozenset(row.file_id for row in rows if row.file_id is not None)
+            unrestricted = any(row.file_id is None for row in rows)
+            default_file_id = read_default_file_id(db.session.connection()) if unrestricted else None
+            entitlements = Entitlements(True, unrestricted, file_ids, default_file_id)
+        else:
+            entitlements = NOT_ENTITLED
+        auth_cache_sync.set(
+            revision, device_id, entitlements,
+            AUTH_CACHE_TTL if entitlements.authorized else AUTH_CACHE_NEGATIVE_TTL
+        )
+        return entitlements
 
     @staticmethod
     def is_device_authorized(device_id):
         """检查设备是否已授权"""
-        cdk = CDK.query.filter_by(device_id=device_id, is_used=True).first()
-        return cdk is not None
+        return CDK.device_entitlements(device_id).authorized
+
+
+class CDKHistory(db.Model):
+    """已清理CDK的归档记录"""
+    __table__ = cdk_history
+
+    def __repr__(self):
+        return f'<CDKHistory {self.cdk_code}>'
+
 
+class CDKStats(db.Model):
+    """CDK计数器，与生成、兑换、清理在同一事务中更新"""
+    __table__ = cdk_stats
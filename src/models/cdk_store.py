@@ -0,0 +1,470 @@
+import base64
+import json
+import secrets
+import string
+from datetime import datetime
+from sqlalchemy import DateTime, bindparam, case, delete, func, literal, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from src.models.schema import cdk_files, cdk_history, cdk_stats, cdks
+
+CDK_ALPHABET = string.ascii_uppercase + string.digits
+CDK_LENGTH = 16
+# 每批插入的CDK数量
+CHUNK_SIZE = 50000
+
+# 随机字节到字母表的映射：只接受小于252（36的整数倍）的字节，避免取模偏差
+_ACCEPT_LIMIT = 256 - 256 % len(CDK_ALPHABET)
+_TRANSLATE_TABLE = bytes(ord(CDK_ALPHABET[i % len(CDK_ALPHABET)]) for i in range(256))
+_REJECT_BYTES = bytes(range(_ACCEPT_LIMIT, 256))
+
+
+def generate_cdk_codes(count):
+    """批量生成随机CDK码"""
+    need = count * CDK_LENGTH
+    buf = bytearray()
+    while len(buf) < need:
+        missing = need - len(buf)
+        raw = secrets.token_bytes(missing * 256 // _ACCEPT_LIMIT + 64)
+        buf += raw.translate(_TRANSLATE_TABLE, _REJECT_BYTES)
+    text = buf[:need].decode('ascii')
+    return [text[i:i + CDK_LENGTH] for i in range(0, need, CDK_LENGTH)]
+
+
+def generate_cdk_code():
+    """生成随机CDK码"""
+    return generate_cdk_codes(1)[0]
+
+
+# 计数器只有一行
+CDK_STATS_ID = 1
+
+
+def adjust_cdk_counters(connection, total=0, used=0, revoke=False):
+    """在调用方的事务中增减计数器，计数器行不存在时重新统计
+
+    revoke为True表示本次修改撤销了设备授权（删除了已使用的CDK），
+    同时增加auth_revision，使所有进程的设备授权缓存失效。
+    """
+    values = {
+        'total': cdk_stats.c.total + total, 'used': cdk_stats.c.used + used,
+        'revision': cdk_stats.c.revision + 1, 'updated_at': datetime.utcnow()
+    }
+    if revoke:
+        values['auth_revision'] = cdk_stats.c.auth_revision + 1
+    result = connection.execute(
+        update(cdk_stats).where(cdk_stats.c.id == CDK_STATS_ID).values(**values)
+    )
+    if result.rowcount == 0:
+        reconcile_cdk_counters(connection)
+
+
+def reconcile_cdk_counters(connection):
+    """从cdks表重新统计计数器，返回(旧计数, 新计数)，旧计数不存在时为None"""
+    stats = cdk_stats
+    old = connection.execute(
+        select(stats.c.total, stats.c.used).where(stats.c.id == CDK_STATS_ID)
+    ).first()
+    total, used = connection.execute(
+        select(func.count(), func.coalesce(func.sum(case((cdks.c.is_used == True, 1), else_=0)), 0))
+    ).one()
+    values = {'total': total, 'used': used, 'updated_at': datetime.utcnow()}
+    if old is None:
+        connection.execute(stats.insert().values(id=CDK_STATS_ID, revision=1, **values))
+        return None, (total, used)
+    connection.execute(
+        update(stats).where(stats.c.id == CDK_STATS_ID).values(revision=stats.c.revision + 1, **values)
+    )
+    return (old.total, old.used), (total, used)
+
+
+def read_cdk_stats(engine):
+    """读取计数器，返回(总数, 已使用数, 修订号)
+
+    CDK的生成、兑换和清理都会更新计数器，修订号不变说明CDK数据没有变化。
+    """
+    stats = cdk_stats
+    with engine.connect() as connection:
+        row = connection.execute(
+            select(stats.c.total, stats.c.used, stats.c.revision).where(stats.c.id == CDK_STATS_ID)
+        ).first()
+    if row is not None:
+        return row.total, row.used, row.revision
+    try:
+        with engine.begin() as connection:
+            reconcile_cdk_counters(connection)
+    except IntegrityError:
+        # 其他进程已同时创建了计数器行
+        pass
+    return read_cdk_stats(engine)
+
+
+def bump_auth_revision(connection):
+    """在调用方的事务中增加设备授权的修订号，使所有进程的设备授权缓存失效"""
+    connection.execute(
+        update(cdk_stats).where(cdk_stats.c.id == CDK_STATS_ID)
+        .values(auth_revision=cdk_stats.c.auth_revision + 1)
+    )
+
+
+def read_auth_revision(connection):
+    """读取设备授权的修订号，计数器行不存在时返回None"""
+    return connection.execute(
+        select(cdk_stats.c.auth_revision).where(cdk_stats.c.id == CDK_STATS_ID)
+    ).scalar()
+
+
+def read_cdk_counters(engine):
+    """读取计数器，返回(总数, 已使用数)"""
+    total, used, _ = read_cdk_stats(engine)
+    return total, used
+
+
+def _insert_ignore_statement(dialect):
+    """构造忽略唯一键冲突的INSERT语句"""
+    table = cdks
+    if dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).on_conflict_do_nothing(index_elements=['cdk_code'])
+    elif dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).on_conflict_do_nothing(index_elements=['cdk_code'])
+    else:
+        stmt = table.insert().prefix_with('IGNORE')
+    return stmt.values(
+        cdk_code=bindparam('cdk_code'),
+        is_used=bindparam('is_used'),
+        created_at=bindparam('created_at')
+    )
+
+
+class _BulkInserter:
+    """预编译INSERT语句，直接以DBAPI参数格式executemany
+
+    is_used和created_at在一批中是常量，只做一次类型转换，
+    避免SQLAlchemy逐行处理参数的开销。
+    """
+
+    def __init__(self, connection, created_at):
+        dialect = connection.dialect
+        compiled = _insert_ignore_statement(dialect).compile(dialect=dialect)
+        self.sql = str(compiled)
+        table = cdks
+        constants = {
+            'is_used': self._process(table.c.is_used.type, dialect, False),
+            'created_at': self._process(table.c.created_at.type, dialect, created_at),
+        }
+        if compiled.positiontup:
+            order = list(compiled.positiontup)
+            code_index = order.index('cdk_code')
+            template = [constants.get(name) for name in order]
+
+            def make_row(code):
+                row = template[:]
+                row[code_index] = code
+                return tuple(row)
+        else:
+            def make_row(code):
+                return dict(constants, cdk_code=code)
+        self.make_row = make_row
+
+    @staticmethod
+    def _process(type_, dialect, value):
+        processor = type_.bind_processor(dialect)
+        return processor(value) if processor else value
+
+    def insert(self, connection, codes):
+        """插入一批CDK，返回实际插入的行数"""
+        result = connection.exec_driver_sql(self.sql, [self.make_row(code) for code in codes])
+        return result.rowcount
+
+
+def create_cdks(engine, count, chunk_size=CHUNK_SIZE, return_codes=False, on_chunk=None,
+                file_ids=None):
+    """批量生成并插入count个唯一CDK
+
+    候选码先在批内用集合去重，再通过唯一索引INSERT OR IGNORE插入；
+    与已有CDK冲突而被忽略的数量会在后续批次中补足。每批单独提交，
+    不会长时间占用写锁。指定file_ids时在同一事务中写入文件授权。
+    返回(插入数量, CDK列表)，CDK列表仅在return_codes为True时填充。
+    """
+    created_at = datetime.utcnow()
+    codes_out = []
+    inserted_total = 0
+
+    with engine.connect() as connection:
+        inserter = _BulkInserter(connection, created_at)
+        while inserted_total < count:
+            wanted = min(chunk_size, count - inserted_total)
+            # 排序后插入，唯一索引的B树写入更集中
+            codes = sorted(set(generate_cdk_codes(wanted)))
+            last_id = connection.execute(select(func.max(cdks.c.id))).scalar() or 0
+            inserted = inserter.insert(connection, codes)
+            adjust_cdk_counters(connection, total=inserted)
+            if file_ids:
+                _grant_files(connection, file_ids, created_at, last_id)
+            if return_codes:
+                if inserted == len(codes):
+                    codes_out.extend(codes)
+                else:
+                    codes_out.extend(_inserted_codes(connection, codes, created_at))
+            connection.commit()
+            inserted_total += inserted
+            if on_chunk is not None:
+                on_chunk(inserted_total)
+
+    return inserted_total, codes_out
+
+
+def _grant_files(connection, file_ids, created_at, last_id):
+    """为本批插入的CDK（主键大于last_id且created_at相同）写入文件授权"""
+    table = cdks
+    for file_id in file_ids:
+        connection.execute(cdk_files.insert().from_select(
+            ['cdk_id', 'file_id'],
+            select(table.c.id, literal(file_id)).where(
+                table.c.id > last_id,
+                table.c.created_at == created_at
+            )
+        ))
+
+
+def _inserted_codes(connection, codes, created_at):
+    """出现冲突时，找出本批实际插入的CDK（同一批的created_at完全相同）"""
+    table = cdks
+    found = []
+    for i in range(0, len(codes), 500):
+        found.extend(connection.execute(
+            select(table.c.cdk_code).where(
+                table.c.cdk_code.in_(codes[i:i + 500]),
+                table.c.created_at == created_at
+            )
+        ).scalars())
+    return found
+
+
+# 导出格式及对应的MIME类型
+EXPORT_FORMATS = {
+    'txt': 'text/plain',
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+# 导出时每批读取的行数
+EXPORT_BATCH_SIZE = 10000
+
+
+def iter_unused_batches(engine, with_created_at=True, batch_size=EXPORT_BATCH_SIZE):
+    """按主键分批读取未使用的CDK，每次yield一批行
+
+    每批是一次独立的短查询，导出大量数据时不会长时间持有读锁。
+    """
+    table = cdks
+    columns = [table.c.id, table.c.cdk_code]
+    if with_created_at:
+        columns.append(table.c.created_at)
+    last_id = 0
+    while True:
+        with engine.connect() as connection:
+            rows = connection.execute(
+                select(*columns)
+                .where(table.c.is_used == False, table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def stream_export(engine, fmt='txt', total=None, batch_size=EXPORT_BATCH_SIZE):
+    """生成导出内容，每批拼接成一个字符串yield"""
+    if fmt == 'txt':
+        header = "# CDK码列表\n"
+        header += f"# 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        if total is not None:
+            header += f"# 总数量: {total}\n"
+        yield header + "\n"
+        for rows in iter_unused_batches(engine, False, batch_size):
+            yield ''.join([f"{row.cdk_code}\n" for row in rows])
+        return
+
+    if fmt == 'csv':
+        yield "cdk_code,created_at\n"
+    for rows in iter_unused_batches(engine, True, batch_size):
+        if fmt == 'csv':
+            lines = [
+                f"{row.cdk_code},{row.created_at.isoformat() if row.created_at else ''}\n"
+                for row in rows
+            ]
+        else:
+            lines = [
+                json.dumps({
+                    'cdk_code': row.cdk_code,
+                    'created_at': row.created_at.isoformat() if row.created_at else None
+                }) + "\n"
+                for row in rows
+            ]
+        yield ''.join(lines)
+
+
+# 列表分页的默认和最大每页数量
+LIST_PAGE_SIZE = 50
+MAX_LIST_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at, cdk_id):
+    """将分页位置编码为不透明的游标字符串"""
+    raw = f"{created_at.isoformat() if created_at else ''}|{cdk_id}"
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，格式错误时抛出ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, cdk_id = base64.urlsafe_b64decode(padded).decode('ascii').split('|')
+        return datetime.fromisoformat(created_at), int(cdk_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'无效的游标: {cursor}') from e
+
+
+def list_cdks_page(engine, cursor=None, limit=LIST_PAGE_SIZE, status=None,
+                   created_from=None, created_to=None, used_from=None, used_to=None):
+    """按(created_at, id)倒序键集分页列出CDK
+
+    返回(CDK字典列表, 下一页游标)，没有下一页时游标为None。
+    """
+    table = cdks
+    limit = max(1, min(limit, MAX_LIST_PAGE_SIZE))
+
+    stmt = select(
+        table.c.id, table.c.cdk_code, table.c.is_used, table.c.device_id,
+        table.c.created_at, table.c.used_at
+    )
+    if status == 'used':
+        stmt = stmt.where(table.c.is_used == True)
+    elif status == 'unused':
+        stmt = stmt.where(table.c.is_used == False)
+    if created_from is not None:
+        stmt = stmt.where(table.c.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(table.c.created_at < created_to)
+    if used_from is not None:
+        stmt = stmt.where(table.c.used_at >= used_from)
+    if used_to is not None:
+        stmt = stmt.where(table.c.used_at < used_to)
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        stmt = stmt.where(
+            tuple_(table.c.created_at, table.c.id) < tuple_(cursor_created_at, cursor_id)
+        )
+    stmt = stmt.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(limit + 1)
+
+    with engine.connect() as connection:
+        rows = connection.execute(stmt).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    items = [{
+        'id': row.id,
+        'cdk_code': row.cdk_code,
+        'is_used': row.is_used,
+        'device_id': row.device_id,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'used_at': row.used_at.isoformat() if row.used_at else None
+    } for row in rows]
+    return items, next_cursor
+
+
+# 清理时每批删除的行数，每批单独提交，兑换请求可以在批次之间执行
+CLEANUP_CHUNK_SIZE = 5000
+# 清理时的归档方式
+ARCHIVE_MODES = ('table', 'jsonl')
+
+
+def _cleanup_conditions(older_than):
+    table = cdks
+    conditions = [table.c.is_used == True]
+    if older_than is not None:
+        conditions.append(table.c.used_at < older_than)
+    return conditions
+
+
+def count_used_cdks(engine, older_than=None):
+    """统计待清理的已使用CDK数量"""
+    with engine.connect() as connection:
+        return connection.execute(
+            select(func.count()).select_from(cdks).where(*_cleanup_conditions(older_than))
+        ).scalar()
+
+
+def cleanup_used_cdks(engine, older_than=None, archive=None, archive_file=None,
+                      chunk_size=CLEANUP_CHUNK_SIZE):
+    """分批删除已使用的CDK，返回删除的数量
+
+    每批取出一组主键后按主键删除，可选在同一事务中先归档到
+    cdk_history表（archive='table'），或写入JSONL文件（archive='jsonl'）。
+    older_than不为空时只删除在该时间之前使用的CDK。
+    """
+    if archive not in (None,) + ARCHIVE_MODES:
+        raise ValueError(f'不支持的归档方式: {archive}')
+    if archive == 'jsonl' and not archive_file:
+        raise ValueError('JSONL归档需要指定文件路径')
+
+    table = cdks
+    history = cdk_history
+    conditions = _cleanup_conditions(older_than)
+    removed = 0
+    last_id = 0
+    writer = open(archive_file, 'a', encoding='utf-8') if archive == 'jsonl' else None
+
+    try:
+        while True:
+            with engine.begin() as connection:
+                # 先取出本批的主键（JSONL归档同时取出要写入的字段），之后只按这些主键
+                # 归档和删除。SQLite驱动在第一条写语句之前才开始事务，如果按主键范围
+                # 删除，其间新兑换的CDK会被删除却没有归档
+                columns = [table.c.id]
+                if archive == 'jsonl':
+                    columns += [table.c.cdk_code, table.c.device_id, table.c.created_at, table.c.used_at]
+                rows = connection.execute(
+                    select(*columns)
+                    .where(*conditions, table.c.id > last_id)
+                    .order_by(table.c.id)
+                    .limit(chunk_size)
+                ).all()
+                if not rows:
+                    break
+                chunk_ids = [row.id for row in rows]
+
+                if archive == 'table':
+                    connection.execute(history.insert().from_select(
+                        ['cdk_code', 'device_id', 'created_at', 'used_at', 'archived_at'],
+                        select(
+                            table.c.cdk_code, table.c.device_id, table.c.created_at,
+                            table.c.used_at, literal(datetime.utcnow(), DateTime)
+                        ).where(table.c.id.in_(chunk_ids))
+                    ))
+                elif archive == 'jsonl':
+                    writer.write(''.join(json.dumps({
+                        'cdk_code': row.cdk_code,
+                        'device_id': row.device_id,
+                        'created_at': row.created_at.isoformat() if row.created_at else None,
+                        'used_at': row.used_at.isoformat() if row.used_at else None
+                    }) + "\n" for row in rows))
+                    writer.flush()
+
+                connection.execute(delete(cdk_files).where(cdk_files.c.cdk_id.in_(chunk_ids)))
+                deleted = connection.execute(delete(table).where(table.c.id.in_(chunk_ids))).rowcount
+                # 删除的都是已使用的CDK
+                adjust_cdk_counters(connection, total=-deleted, used=-deleted, revoke=deleted > 0)
+                removed += deleted
+                last_id = chunk_ids[-1]
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return removed
@@ -0,0 +1,59 @@
+from datetime import datetime
+from sqlalchemy import select, update
+from src.models.cdk_store import bump_auth_revision
+from src.models.schema import cdk_files, files
+from src.models.user import db
+
+class File(db.Model):
+    """可下载的文件（产品），name对应内容寻址存储索引中的文件名"""
+    __table__ = files
+
+    def __repr__(self):
+        return f'<File {self.name}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'sha256': self.sha256,
+            'size': self.size,
+            'content_type': self.content_type,
+            'is_default': self.is_default,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class CDKFile(db.Model):
+    """CDK可下载的文件，没有任何记录的CDK只能下载默认文件"""
+    __table__ = cdk_files
+
+
+def read_default_file_id(connection):
+    """固定的默认文件id，没有时返回None"""
+    return connection.execute(
+        select(files.c.id).where(files.c.is_default == True).order_by(files.c.id).limit(1)
+    ).scalar()
+
+
+def upsert_file(connection, name, sha256, size, content_type):
+    """发布文件时按文件名创建或更新File记录，返回文件id
+
+    同名文件重新上传时id保持不变，已有的CDK授权继续有效。
+    还没有默认文件时，新登记的文件成为默认文件，并使缓存的设备授权
+    （其中包含默认文件id）失效。
+    """
+    values = {'sha256': sha256, 'size': size, 'content_type': content_type, 'updated_at': datetime.utcnow()}
+    file_id = connection.execute(
+        select(files.c.id).where(files.c.name == name)
+    ).scalar()
+    if file_id is None:
+        is_default = read_default_file_id(connection) is None
+        file_id = connection.execute(
+            files.insert().values(name=name, created_at=values['updated_at'], is_default=is_default, **values)
+        ).inserted_primary_key[0]
+        if is_default:
+            bump_auth_revision(connection)
+        return file_id
+    connection.execute(update(files).where(files.c.id == file_id).values(**values))
+    return file_id
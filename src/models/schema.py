@@ -0,0 +1,187 @@
+"""
+数据库表结构和版本管理
+
+表以SQLAlchemy Core定义，不依赖Flask：命令行工具直接使用这些表，
+src/models中的Flask-SQLAlchemy模型映射到同一组表上。
+
+数据库中的schema_version表记录结构版本。启动时只读取这一行，
+版本与SCHEMA_VERSION一致时不做任何检查；不一致时才创建缺少的表和索引
+并依次执行之后的迁移。
+"""
+from datetime import datetime
+from sqlalchemy import (
+    BigInteger, Boolean, Column, DateTime, ForeignKey, Index, Integer, MetaData,
+    String, Table, exists, inspect, select, text, update
+)
+from sqlalchemy.exc import DBAPIError
+
+metadata = MetaData()
+
+users = Table(
+    'user', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(80), unique=True, nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+)
+
+cdks = Table(
+    'cdks', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('cdk_code', String(32), unique=True, nullable=False),
+    Column('is_used', Boolean, nullable=False, default=False),
+    Column('device_id', String(128), nullable=True, index=True),
+    Column('created_at', DateTime, default=datetime.utcnow),
+    Column('used_at', DateTime, nullable=True),
+    # 支持按(created_at, id)的键集分页及按状态、使用时间筛选
+    Index('ix_cdks_created_at_id', 'created_at', 'id'),
+    Index('ix_cdks_is_used_created_at_id', 'is_used', 'created_at', 'id'),
+    Index('ix_cdks_used_at', 'used_at'),
+)
+
+# 已清理CDK的归档记录
+cdk_history = Table(
+    'cdk_history', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('cdk_code', String(32), nullable=False, index=True),
+    Column('device_id', String(128), nullable=True),
+    Column('created_at', DateTime, nullable=True),
+    Column('used_at', DateTime, nullable=True),
+    Column('archived_at', DateTime, nullable=False, default=datetime.utcnow),
+)
+
+# CDK计数器，与生成、兑换、清理在同一事务中更新；
+# revision在每次更新时加1，用于判断CDK数据是否有变化；
+# auth_revision在清理（撤销设备授权）时加1，各进程据此清空设备授权缓存
+cdk_stats = Table(
+    'cdk_stats', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('total', Integer, nullable=False, default=0),
+    Column('used', Integer, nullable=False, default=0),
+    Column('updated_at', DateTime, nullable=True),
+    Column('revision', Integer, nullable=False, default=0, server_default='0'),
+    Column('auth_revision', Integer, nullable=False, default=0, server_default='0'),
+)
+
+# 可下载的文件（产品），name对应内容寻址存储索引中的文件名；
+# is_default标记没有指定文件的CDK（旧版CDK）可下载的默认文件，登记第一个文件时固定，
+# 之后为其他CDK授权文件不会改变默认文件
+files = Table(
+    'files', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(255), unique=True, nullable=False),
+    Column('sha256', String(64), nullable=False),
+    Column('size', BigInteger, nullable=False),
+    Column('content_type', String(128), nullable=False),
+    Column('created_at', DateTime, default=datetime.utcnow),
+    Column('updated_at', DateTime, default=datetime.utcnow),
+    Column('is_default', Boolean, nullable=False, default=False, server_default=text('false')),
+)
+
+# CDK可下载的文件，没有任何记录的CDK只能下载默认文件
+cdk_files = Table(
+    'cdk_files', metadata,
+    Column('cdk_id', Integer, ForeignKey('cdks.id', ondelete='CASCADE'), primary_key=True),
+    Column('file_id', Integer, ForeignKey('files.id', ondelete='CASCADE'), primary_key=True),
+    # 主键(cdk_id, file_id)支持按CDK查询，按文件反查使用单独的索引
+    Index('ix_cdk_files_file_id', 'file_id'),
+)
+
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, nullable=False),
+)
+
+
+def _create_missing_indexes(connection):
+    """为已存在的表补建后来新增的索引（create_all不会修改已存在的表）"""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _add_column(connection, table, column):
+    """为已存在的表添加列，列已存在时跳过"""
+    existing = {c['name'] for c in inspect(connection).get_columns(table.name)}
+    if column.name in existing:
+        return
+    column_type = column.type.compile(dialect=connection.dialect)
+    ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+    if not column.nullable:
+        ddl += ' NOT NULL'
+    if column.server_default is not None:
+        ddl += f' DEFAULT {column.server_default.arg}'
+    connection.exec_driver_sql(ddl)
+
+
+def _add_cdk_stats_revision(connection):
+    _add_column(connection, cdk_stats, cdk_stats.c.revision)
+
+
+def _add_cdk_stats_auth_revision(connection):
+    _add_column(connection, cdk_stats, cdk_stats.c.auth_revision)
+
+
+
+def _add_files_is_default(connection):
+    """添加is_default列，并把此前作为默认文件的文件固定下来
+
+    此前的默认文件是没有CDK授权记录的文件中按文件名排序的第一个。
+    """
+    _add_column(connection, files, files.c.is_default)
+    if connection.execute(select(files.c.id).where(files.c.is_default == True).limit(1)).first():
+        return
+    file_id = connection.execute(
+        select(files.c.id)
+        .where(~exists().where(cdk_files.c.file_id == files.c.id))
+        .order_by(files.c.name)
+        .limit(1)
+    ).scalar()
+    if file_id is not None:
+        connection.execute(update(files).where(files.c.id == file_id).values(is_default=True))
+
+
+# 按版本排列的迁移，升级时执行数据库版本之后的全部迁移。
+# 缺少的表在迁移之前已按最新结构创建，迁移需要能在这样的表上重复执行。
+MIGRATIONS = [
+    (1, _create_missing_indexes),
+    (2, _add_cdk_stats_revision),
+    (3, _add_cdk_stats_auth_revision),
+    (4, _add_files_is_default),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def read_schema_version(engine):
+    """读取数据库的结构版本，没有版本表时返回None"""
+    try:
+        with engine.connect() as connection:
+            return connection.execute(select(schema_version.c.version)).scalar()
+    except DBAPIError:
+        return None
+
+
+def ensure_schema(engine):
+    """确保数据库结构为最新版本，返回升级前的版本（新数据库为None）
+
+    新数据库直接按最新结构建表；没有版本记录的旧数据库从版本0开始迁移。
+    """
+    version = read_schema_version(engine)
+    if version == SCHEMA_VERSION:
+        return version
+    try:
+        with engine.begin() as connection:
+            start = version
+            if start is None:
+                # 版本表不存在：已有cdks表的是引入版本管理之前的数据库
+                start = 0 if inspect(connection).has_table(cdks.name) else SCHEMA_VERSION
+            metadata.create_all(connection)
+            for target, migrate in MIGRATIONS:
+                if target > start:
+                    migrate(connection)
+            connection.execute(schema_version.delete())
+            connection.execute(schema_version.insert().values(version=SCHEMA_VERSION))
+    except DBAPIError:
+        # 其他进程同时完成了升级
+        if read_schema_version(engine) != SCHEMA_VERSION:
+            raise
+    return version
@@ -0,0 +1,107 @@
+"""
+数据库连接配置
+
+应用（Flask-SQLAlchemy）和命令行工具使用同一套配置：
+
+- DATABASE_URL指定数据库，默认为src/database/app.db，也可以改为PostgreSQL/MySQL等服务器数据库
+- SQLite连接建立时通过connect事件设置WAL日志、synchronous、busy_timeout、mmap和页缓存，
+  读取不阻塞兑换等写入，应用和命令行工具同时写入时等待锁而不是立即报错
+- 连接池大小等参数通过环境变量调整
+"""
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URL = (
+    f"sqlite:///{os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database', 'app.db')}"
+)
+
+# SQLite日志模式，WAL模式下读写互不阻塞（设为DELETE可恢复SQLite默认行为）
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL').upper()
+# WAL模式下NORMAL只在检查点时同步磁盘，进程崩溃不丢数据，断电可能丢失最近提交的事务
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+# 数据库被锁定时等待的最长时间（毫秒）
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))
+# 内存映射读取的大小（字节），为0时不使用mmap
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+# 每个连接的页缓存大小（KB）
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', '16384'))
+
+# 连接池：常驻连接数、允许额外创建的连接数、等待空闲连接的超时（秒）
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+# 服务器数据库的连接回收时间（秒），避免使用被服务器关闭的空闲连接
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+
+_JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+_SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def database_url():
+    """环境变量DATABASE_URL指定的数据库地址
+
+    兼容部分托管平台提供的postgres://前缀（SQLAlchemy只接受postgresql://）。
+    """
+    url = os.environ.get('DATABASE_URL') or DEFAULT_DATABASE_URL
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def _is_file_sqlite(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def engine_options(url):
+    """create_engine的参数，也用作Flask-SQLAlchemy的SQLALCHEMY_ENGINE_OPTIONS"""
+    if make_url(url).get_backend_name() == 'sqlite':
+        if not _is_file_sqlite(url):
+            # 内存数据库使用SQLAlchemy默认的单连接池
+            return {}
+        return {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            # sqlite3模块的timeout即busy_timeout（秒）
+            'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT / 1000},
+        }
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}')
+        cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+        cursor.execute(f'PRAGMA cache_size={-SQLITE_CACHE_SIZE}')
+    finally:
+        cursor.close()
+
+
+def configure_engine(engine):
+    """为文件SQLite数据库注册设置PRAGMA的connect事件，需在建立第一个连接之前调用"""
+    if not _is_file_sqlite(engine.url):
+        return engine
+    if SQLITE_JOURNAL_MODE not in _JOURNAL_MODES:
+        raise ValueError(f"SQLITE_JOURNAL_MODE必须是{'、'.join(_JOURNAL_MODES)}之一")
+    if SQLITE_SYNCHRONOUS not in _SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS必须是{'、'.join(_SYNCHRONOUS_MODES)}之一")
+    if not event.contains(engine, 'connect', _set_sqlite_pragmas):
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    return engine
+
+
+def create_db_engine(url=None):
+    """按配置创建数据库引擎（命令行工具等不使用Flask的场景）"""
+    url = url or database_url()
+    return configure_engine(create_engine(url, **engine_options(url)))
@@ -1,11 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
+from src.models.schema import metadata, users
 
-db = SQLAlchemy()
+# 模型映射到src/models/schema.py中定义的表
+db = SQLAlchemy(metadata=metadata)
 
 class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
+    __table__ = users
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -1,26 +1,57 @@
-from flask import Blueprint, request, jsonify, render_template_string
-from src.models.cdk import CDK, db
-import secrets
-import string
+from flask import Blueprint, request, jsonify, render_template_string, current_app, Response, send_file
+from src.models.cdk import db, device_auth_cache
+from src.models.cdk_store import (
+    EXPORT_FORMATS, ARCHIVE_MODES, stream_export, read_cdk_counters, reconcile_cdk_counters,
+    read_cdk_stats, list_cdks_page, LIST_PAGE_SIZE, MAX_LIST_PAGE_SIZE,
+    cleanup_used_cdks as delete_used_cdks_in_chunks
+)
+from src.utils.chunked_upload import (
+    UploadError, uploads_dir_for, create_upload, load_upload, write_chunk, finalize_upload, abort_upload
+)
+from src.models.file import File, upsert_file
+from src.utils.bandwidth import downloads
+from src.utils.blob_store import BlobStore
+from src.utils.file_catalog import DOWNLOAD_EXTENSIONS, get_file_catalog, guess_content_type
+from src.utils.profiler import list_profiles, profile_path, format_profile, profiling_enabled
+from src.utils.rate_limit import rate_limit_stats
+from src.utils.static_assets import make_static_entry, serve_static
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 
 admin_bp = Blueprint('admin', __name__)
 
 # 允许的文件扩展名
 ALLOWED_EXTENSIONS = {'zip', 'exe', 'rar', '7z', 'tar', 'gz', 'pdf', 'doc', 'docx', 'txt'}
-# 最大文件大小 (100MB)
+# 单次表单上传的最大文件大小 (100MB)，更大的文件使用分块上传接口
 MAX_FILE_SIZE = 100 * 1024 * 1024
 
+def format_file_size(size):
+    """格式化文件大小"""
+    if size < 1024:
+        return f"{size} B"
+    elif size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    elif size < 1024 * 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    else:
+        return f"{size / (1024 * 1024 * 1024):.1f} GB"
+
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def generate_cdk_code():
-    """生成随机CDK码"""
-    return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(16))
+def publish_file(files_dir, store, filename, sha256, size):
+    """发布已存入内容寻址存储的文件，可下载的文件同时登记File记录，返回文件id"""
+    content_type = guess_content_type(filename)
+    file_id = None
+    if filename.lower().endswith(DOWNLOAD_EXTENSIONS):
+        with db.engine.begin() as connection:
+            file_id = upsert_file(connection, filename, sha256, size, content_type)
+    store.publish(filename, sha256, size, content_type, file_id=file_id)
+    get_file_catalog(files_dir).invalidate()
+    return file_id
 
 # 简单的管理界面HTML模板
 ADMIN_TEMPLATE = """
@@ -127,7 +158,9 @@ ADMIN_TEMPLATE = """
             border-radius: 4px;
         }
         .cdk-item {
-            padding: 10px;
+            height: 40px;
+            box-sizing: border-box;
+            padding: 0 10px;
             border-bottom: 1px solid #f0f0f0;
             display: flex;
             justify-content: space-between;
@@ -199,25 +232,40 @@ ADMIN_TEMPLATE = """
             <h2>生成CDK</h2>
             <div class="form-group">
                 <label for="count">生成数量:</label>
-                <input type="number" id="count" min="1" max="100" value="1">
+                <input type="number" id="count" min="1" max="1000000" value="1">
                 <button onclick="generateCDKs()" class="success">生成CDK</button>
             </div>
+            <div class="form-group">
+                <label for="fileIds">可下载文件（不选则为默认文件）:</label>
+                <select id="fileIds" multiple></select>
+            </div>
             <div id="generateMessage"></div>
         </div>
         
         <div class="section">
             <h2>CDK列表</h2>
-            <button onclick="loadCDKs()">刷新列表</button>
+            <select id="statusFilter" onchange="loadDashboard()">
+                <option value="">全部</option>
+                <option value="unused">未使用</option>
+                <option value="used">已使用</option>
+            </select>
+            <button onclick="loadDashboard()">刷新列表</button>
             <button onclick="exportCDKs()" class="success">导出未使用CDK</button>
             <button onclick="deleteUsedCDKs()" class="danger">删除已使用CDK</button>
-            <div id="cdkList" class="cdk-list">
-                <!-- CDK列表将通过JavaScript加载 -->
+            <div id="cdkList" class="cdk-list" onscroll="renderCDKs()">
+                <!-- CDK列表通过JavaScript分页加载，只渲染可见的行 -->
+                <div id="cdkSpacer" style="position: relative;">
+                    <div id="cdkViewport" style="position: absolute; top: 0; left: 0; right: 0;"></div>
+                </div>
             </div>
         </div>
     </div>
 
     <script>
-        // 上传文件
+        // 分块上传失败时每块的最大重试次数
+        const UPLOAD_MAX_RETRIES = 5;
+        
+        // 上传文件（分块上传，断线后从服务器记录的偏移量继续）
         async function uploadFile() {
             const fileInput = document.getElementById('fileInput');
             const messageDiv = document.getElementById('uploadMessage');
@@ -232,95 +280,131 @@ ADMIN_TEMPLATE = """
             
             const file = fileInput.files[0];
             
-            // 检查文件大小 (100MB)
-            if (file.size > 100 * 1024 * 1024) {
-                messageDiv.innerHTML = '<div class="message error">文件大小不能超过100MB</div>';
-                return;
+            function showProgress(offset) {
+                const percentComplete = file.size ? (offset / file.size) * 100 : 100;
+                progressBar.style.width = percentComplete + '%';
+                progressText.textContent = `上传中... ${Math.round(percentComplete)}%`;
             }
             
-            const formData = new FormData();
-            formData.append('file', file);
-            
             try {
-                // 显示进度条
                 progressDiv.style.display = 'block';
                 messageDiv.innerHTML = '';
+                showProgress(0);
                 
-                const xhr = new XMLHttpRequest();
-                
-                // 上传进度
-                xhr.upload.addEventListener('progress', function(e) {
-                    if (e.lengthComputable) {
-                        const percentComplete = (e.loaded / e.total) * 100;
-                        progressBar.style.width = percentComplete + '%';
-                        progressText.textContent = `上传中... ${Math.round(percentComplete)}%`;
-                    }
+                // 创建上传会话
+                const createResponse = await fetch('/admin/api/uploads', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ filename: file.name, size: file.size })
                 });
+                const session = await createResponse.json();
+                if (session.status !== 'success') {
+                    throw new Error(session.message);
+                }
+                
+                const uploadUrl = `/admin/api/uploads/${session.upload_id}`;
+                const chunkSize = session.chunk_size;
+                let offset = 0;
+                let retries = 0;
                 
-                // 上传完成
-                xhr.addEventListener('load', function() {
-                    progressDiv.style.display = 'none';
-                    
-                    if (xhr.status === 200) {
-                        const data = JSON.parse(xhr.responseText);
-                        if (data.status === 'success') {
-                            messageDiv.innerHTML = `<div class="message success">${data.message}</div>`;
-                            fileInput.value = ''; // 清空文件选择
-                        } else {
-                            messageDiv.innerHTML = `<div class="message error">${data.message}</div>`;
+                while (offset < file.size) {
+                    const index = Math.floor(offset / chunkSize);
+                    const start = index * chunkSize;
+                    try {
+                        const response = await fetch(`${uploadUrl}/chunks/${index}`, {
+                            method: 'PUT',
+                            headers: {
+                                'Content-Type': 'application/octet-stream',
+                                'Upload-Offset': String(start)
+                            },
+                            body: file.slice(start, start + chunkSize)
+                        });
+                        const data = await response.json();
+                        if (data.status !== 'success') {
+                            throw new Error(data.message);
+                        }
+                        offset = data.offset;
+                        retries = 0;
+                        showProgress(offset);
+                    } catch (error) {
+                        if (++retries > UPLOAD_MAX_RETRIES) {
+                            throw error;
+                        }
+                        // 等待后从服务器记录的偏移量继续
+                        await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                        try {
+                            const status = await (await fetch(uploadUrl)).json();
+                            if (status.status === 'success') {
+                                offset = status.offset;
+                            }
+                        } catch (ignored) {
                         }
-                    } else {
-                        messageDiv.innerHTML = '<div class="message error">上传失败，请重试</div>';
                     }
-                });
-                
-                // 上传错误
-                xhr.addEventListener('error', function() {
-                    progressDiv.style.display = 'none';
-                    messageDiv.innerHTML = '<div class="message error">上传失败，请检查网络连接</div>';
-                });
+                }
                 
-                xhr.open('POST', '/admin/api/upload');
-                xhr.send(formData);
+                // 完成上传
+                const completeResponse = await fetch(`${uploadUrl}/complete`, { method: 'POST' });
+                const data = await completeResponse.json();
+                progressDiv.style.display = 'none';
                 
+                if (data.status === 'success') {
+                    messageDiv.innerHTML = `<div class="message success">${data.message}</div>`;
+                    fileInput.value = ''; // 清空文件选择
+                    loadFiles();
+                } else {
+                    messageDiv.innerHTML = `<div class="message error">${data.message}</div>`;
+                }
             } catch (error) {
                 progressDiv.style.display = 'none';
-                messageDiv.innerHTML = '<div class="message error">上传失败</div>';
+                messageDiv.innerHTML = `<div class="message error">上传失败: ${error.message || '请检查网络连接'}</div>`;
             }
         }
         
-        // 加载统计信息
-        async function loadStats() {
+        // 显示统计信息
+        function renderStats(data) {
+            document.getElementById('stats').innerHTML = `
+                <div class="stat-card">
+                    <div class="stat-number">${data.total}</div>
+                    <div class="stat-label">总CDK数</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-number">${data.unused}</div>
+                    <div class="stat-label">未使用</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-number">${data.used}</div>
+                    <div class="stat-label">已使用</div>
+                </div>
+            `;
+        }
+        
+        // 加载可授权的文件
+        async function loadFiles() {
             try {
-                const response = await fetch('/admin/api/stats');
+                const response = await fetch('/admin/api/files');
                 const data = await response.json();
-                
-                document.getElementById('stats').innerHTML = `
-                    <div class="stat-card">
-                        <div class="stat-number">${data.total}</div>
-                        <div class="stat-label">总CDK数</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">${data.unused}</div>
-                        <div class="stat-label">未使用</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">${data.used}</div>
-                        <div class="stat-label">已使用</div>
-                    </div>
-                `;
+                const select = document.getElementById('fileIds');
+                select.innerHTML = '';
+                for (const file of data.files || []) {
+                    const option = document.createElement('option');
+                    option.value = file.id;
+                    option.textContent = file.name;
+                    select.appendChild(option);
+                }
             } catch (error) {
-                console.error('加载统计信息失败:', error);
+                console.error('加载文件列表失败:', error);
             }
         }
         
         // 生成CDK
         async function generateCDKs() {
             const count = document.getElementById('count').value;
+            const fileIds = Array.from(document.getElementById('fileIds').selectedOptions)
+                .map(option => parseInt(option.value));
             const messageDiv = document.getElementById('generateMessage');
             
-            if (!count || count < 1 || count > 100) {
-                messageDiv.innerHTML = '<div class="message error">请输入1-100之间的数量</div>';
+            if (!count || count < 1 || count > 1000000) {
+                messageDiv.innerHTML = '<div class="message error">请输入1-1000000之间的数量</div>';
                 return;
             }
             
@@ -330,15 +414,14 @@ ADMIN_TEMPLATE = """
                     headers: {
                         'Content-Type': 'application/json',
                     },
-                    body: JSON.stringify({ count: parseInt(count) })
+                    body: JSON.stringify({ count: parseInt(count), file_ids: fileIds })
                 });
                 
                 const data = await response.json();
                 
                 if (data.status === 'success') {
-                    messageDiv.innerHTML = `<div class="message success">成功生成 ${count} 个CDK</div>`;
-                    loadStats();
-                    loadCDKs();
+                    messageDiv.innerHTML = `<div class="message success">成功生成 ${data.count} 个CDK</div>`;
+                    loadDashboard();
                 } else {
                     messageDiv.innerHTML = `<div class="message error">${data.message}</div>`;
                 }
@@ -347,48 +430,142 @@ ADMIN_TEMPLATE = """
             }
         }
         
-        // 加载CDK列表
-        async function loadCDKs() {
+        // CDK列表状态：分页游标加载，虚拟滚动渲染
+        const ROW_HEIGHT = 40;
+        const PAGE_SIZE = 200;
+        const cdkState = { items: [], cursor: null, hasMore: true, loading: false, generation: 0 };
+        
+        // 重新加载统计信息和第一页CDK（一个请求，数据没有变化时服务器按ETag返回304）
+        async function loadDashboard() {
+            cdkState.generation += 1;
+            cdkState.items = [];
+            cdkState.cursor = null;
+            cdkState.hasMore = true;
+            cdkState.loading = true;
+            document.getElementById('cdkList').scrollTop = 0;
+            const generation = cdkState.generation;
+            
+            const params = new URLSearchParams({ limit: PAGE_SIZE });
+            const status = document.getElementById('statusFilter').value;
+            if (status) {
+                params.set('status', status);
+            }
+            
             try {
-                const response = await fetch('/api/list_cdks');
+                const response = await fetch(`/admin/api/dashboard?${params}`);
                 const data = await response.json();
                 
-                const listDiv = document.getElementById('cdkList');
+                // 加载期间列表已被重置，丢弃旧结果
+                if (generation !== cdkState.generation) {
+                    return;
+                }
                 
-                if (data.status === 'success' && data.cdks.length > 0) {
-                    listDiv.innerHTML = data.cdks.map(cdk => `
-                        <div class="cdk-item">
-                            <span class="cdk-code">${cdk.cdk_code}</span>
-                            <span class="status ${cdk.is_used ? 'used' : 'unused'}">
-                                ${cdk.is_used ? '已使用' : '未使用'}
-                            </span>
-                        </div>
-                    `).join('');
+                if (data.status === 'success') {
+                    renderStats(data);
+                    cdkState.items = data.cdks;
+                    cdkState.cursor = data.next_cursor;
+                    cdkState.hasMore = data.has_more;
                 } else {
-                    listDiv.innerHTML = '<div style="padding: 20px; text-align: center; color: #666;">暂无CDK记录</div>';
+                    cdkState.hasMore = false;
                 }
             } catch (error) {
-                console.error('加载CDK列表失败:', error);
+                console.error('加载仪表板数据失败:', error);
+                cdkState.hasMore = false;
+            } finally {
+                if (generation === cdkState.generation) {
+                    cdkState.loading = false;
+                }
             }
+            renderCDKs();
         }
         
-        // 导出CDK
-        async function exportCDKs() {
+        // 加载下一页CDK
+        async function loadMoreCDKs() {
+            if (cdkState.loading || !cdkState.hasMore) {
+                return;
+            }
+            cdkState.loading = true;
+            const generation = cdkState.generation;
+            
+            const params = new URLSearchParams({ limit: PAGE_SIZE });
+            const status = document.getElementById('statusFilter').value;
+            if (status) {
+                params.set('status', status);
+            }
+            if (cdkState.cursor) {
+                params.set('cursor', cdkState.cursor);
+            }
+            
             try {
-                const response = await fetch('/admin/api/export');
-                const blob = await response.blob();
+                const response = await fetch(`/api/list_cdks?${params}`);
+                const data = await response.json();
                 
-                const url = window.URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = url;
-                a.download = `cdks_${new Date().toISOString().split('T')[0]}.txt`;
-                document.body.appendChild(a);
-                a.click();
-                window.URL.revokeObjectURL(url);
-                document.body.removeChild(a);
+                // 加载期间列表已被重置，丢弃旧结果
+                if (generation !== cdkState.generation) {
+                    return;
+                }
+                
+                if (data.status === 'success') {
+                    cdkState.items.push(...data.cdks);
+                    cdkState.cursor = data.next_cursor;
+                    cdkState.hasMore = data.has_more;
+                } else {
+                    cdkState.hasMore = false;
+                }
             } catch (error) {
-                alert('导出失败');
+                console.error('加载CDK列表失败:', error);
+                cdkState.hasMore = false;
+            } finally {
+                if (generation === cdkState.generation) {
+                    cdkState.loading = false;
+                }
+            }
+            renderCDKs();
+        }
+        
+        // 只渲染可见区域附近的行
+        function renderCDKs() {
+            const listDiv = document.getElementById('cdkList');
+            const spacer = document.getElementById('cdkSpacer');
+            const viewport = document.getElementById('cdkViewport');
+            const items = cdkState.items;
+            
+            if (items.length === 0) {
+                spacer.style.height = 'auto';
+                viewport.style.position = 'static';
+                viewport.innerHTML = cdkState.loading || cdkState.hasMore ? '' :
+                    '<div style="padding: 20px; text-align: center; color: #666;">暂无CDK记录</div>';
+                return;
             }
+            
+            viewport.style.position = 'absolute';
+            spacer.style.height = `${items.length * ROW_HEIGHT}px`;
+            const first = Math.max(0, Math.floor(listDiv.scrollTop / ROW_HEIGHT) - 10);
+            const last = Math.min(items.length, first + Math.ceil(listDiv.clientHeight / ROW_HEIGHT) + 20);
+            viewport.style.transform = `translateY(${first * ROW_HEIGHT}px)`;
+            viewport.innerHTML = items.slice(first, last).map(cdk => `
+                <div class="cdk-item">
+                    <span class="cdk-code">${cdk.cdk_code}</span>
+                    <span class="status ${cdk.is_used ? 'used' : 'unused'}">
+                        ${cdk.is_used ? '已使用' : '未使用'}
+                    </span>
+                </div>
+            `).join('');
+            
+            // 接近列表末尾时加载下一页
+            if (last >= items.length - 20) {
+                loadMoreCDKs();
+            }
+        }
+        
+        // 导出CDK（由浏览器直接流式下载，不在页面内存中缓存）
+        async function exportCDKs() {
+            const a = document.createElement('a');
+            a.href = '/admin/api/export';
+            a.download = `cdks_${new Date().toISOString().split('T')[0]}.txt`;
+            document.body.appendChild(a);
+            a.click();
+            document.body.removeChild(a);
         }
         
         // 删除已使用的CDK
@@ -405,8 +582,7 @@ ADMIN_TEMPLATE = """
                 
                 if (data.status === 'success') {
                     alert(data.message);
-                    loadStats();
-                    loadCDKs();
+                    loadDashboard();
                 } else {
                     alert(data.message);
                 }
@@ -417,59 +593,175 @@ ADMIN_TEMPLATE = """
         
         // 页面加载时初始化
         window.onload = function() {
-            loadStats();
-            loadCDKs();
+            loadFiles();
+            loadDashboard();
         };
     </script>
 </body>
 </html>
 """
 
+# 仪表板页面只渲染一次，之后发送缓存的内容（带ETag和gzip版本）
+_dashboard_entry = None
+
 @admin_bp.route('/')
 def admin_dashboard():
     """管理员仪表板"""
-    return render_template_string(ADMIN_TEMPLATE)
+    global _dashboard_entry
+    if _dashboard_entry is None:
+        html = render_template_string(ADMIN_TEMPLATE)
+        _dashboard_entry = make_static_entry(html.encode('utf-8'), 'text/html')
+    return serve_static(_dashboard_entry)
+
+@admin_bp.route('/api/dashboard')
+def get_dashboard():
+    """统计信息和第一页CDK，管理页面刷新时只需要这一个请求
+
+    ETag由CDK计数器的修订号和查询参数组成，CDK没有变化时返回304，
+    只读取计数器一行而不查询列表。查询参数：status(used/unused)、limit。
+    """
+    try:
+        status = request.args.get('status') or None
+        if status not in (None, 'used', 'unused'):
+            return jsonify({'status': 'error', 'message': 'status只能为used或unused'}), 400
+        try:
+            limit = max(1, min(int(request.args.get('limit', LIST_PAGE_SIZE)), MAX_LIST_PAGE_SIZE))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': f'参数错误: {str(e)}'}), 400
+        
+        total, used, revision = read_cdk_stats(db.engine)
+        etag = f"{revision}-{total}-{used}-{status or 'all'}-{limit}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            cdks, next_cursor = list_cdks_page(db.engine, limit=limit, status=status)
+            response = jsonify({
+                'status': 'success',
+                'total': total,
+                'used': used,
+                'unused': total - used,
+                'revision': revision,
+                'cdks': cdks,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+        
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'获取仪表板数据失败: {str(e)}'}), 500
 
 @admin_bp.route('/api/stats')
 def get_stats():
-    """获取CDK统计信息"""
+    """获取CDK统计信息（读取计数器，不扫描cdks表）"""
     try:
-        total = CDK.query.count()
-        used = CDK.query.filter_by(is_used=True).count()
+        total, used = read_cdk_counters(db.engine)
         unused = total - used
         
         return jsonify({
             'status': 'success',
             'total': total,
             'used': used,
-            'unused': unused
+            'unused': unused,
+            'auth_cache': device_auth_cache.stats(),
+            'rate_limit': rate_limit_stats()
         }), 200
         
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'获取统计信息失败: {str(e)}'}), 500
 
+@admin_bp.route('/api/files')
+def list_files():
+    """获取已登记的可下载文件，用于生成CDK时选择授权文件"""
+    try:
+        files = File.query.order_by(File.name).all()
+        return jsonify({
+            'status': 'success',
+            'files': [f.to_dict() for f in files]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'获取文件列表失败: {str(e)}'}), 500
+
+@admin_bp.route('/api/downloads')
+def get_downloads():
+    """当前进程中进行中的下载及实时吞吐量"""
+    try:
+        return jsonify({'status': 'success', **downloads.snapshot()}), 200
+        
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'获取下载信息失败: {str(e)}'}), 500
+
+@admin_bp.route('/api/profiles')
+def get_profiles():
+    """列出请求分析结果"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'enabled': profiling_enabled(),
+            'profiles': list_profiles(current_app.config['PROFILE_DIR'])
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'获取分析结果失败: {str(e)}'}), 500
+
+@admin_bp.route('/api/profiles/<name>')
+def get_profile(name):
+    """下载pstats文件，format=text时返回耗时最多的函数列表"""
+    try:
+        path = profile_path(current_app.config['PROFILE_DIR'], name)
+        if path is None:
+            return jsonify({'status': 'error', 'message': '分析结果不存在'}), 404
+        
+        if request.args.get('format') == 'text':
+            sort = request.args.get('sort', 'cumulative')
+            if sort not in ('cumulative', 'tottime', 'calls'):
+                return jsonify({'status': 'error', 'message': '不支持的排序方式'}), 400
+            return Response(format_profile(path, sort), mimetype='text/plain')
+        return send_file(path, as_attachment=True, download_name=name)
+        
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'获取分析结果失败: {str(e)}'}), 500
+
+@admin_bp.route('/api/stats/reconcile', methods=['POST'])
+def reconcile_stats():
+    """从cdks表重新统计计数器，并报告偏差"""
+    try:
+        with db.engine.begin() as connection:
+            old, (total, used) = reconcile_cdk_counters(connection)
+        
+        result = {'status': 'success', 'total': total, 'used': used, 'drift': None}
+        if old is not None:
+            result['drift'] = {'total': old[0] - total, 'used': old[1] - used}
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'重新统计失败: {str(e)}'}), 500
+
 @admin_bp.route('/api/export')
 def export_cdks():
-    """导出未使用的CDK"""
+    """导出未使用的CDK（流式输出，支持txt/csv/jsonl格式）"""
     try:
-        cdks = CDK.query.filter_by(is_used=False).all()
-        
-        if not cdks:
-            return jsonify({'status': 'error', 'message': '没有未使用的CDK可以导出'}), 404
+        fmt = request.args.get('format', 'txt').lower()
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({
+                'status': 'error',
+                'message': f'不支持的导出格式。支持的格式: {", ".join(EXPORT_FORMATS)}'
+            }), 400
         
-        # 生成文本内容
-        content = f"# CDK码列表\n"
-        content += f"# 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        content += f"# 总数量: {len(cdks)}\n\n"
+        engine = db.engine
+        total, used = read_cdk_counters(engine)
+        total -= used
         
-        for cdk in cdks:
-            content += f"{cdk.cdk_code}\n"
+        if not total:
+            return jsonify({'status': 'error', 'message': '没有未使用的CDK可以导出'}), 404
         
-        from flask import Response
+        filename = f'cdks_{datetime.now().strftime("%Y%m%d")}.{fmt}'
         return Response(
-            content,
-            mimetype='text/plain',
-            headers={'Content-Disposition': f'attachment; filename=cdks_{datetime.now().strftime("%Y%m%d")}.txt'}
+            stream_export(engine, fmt, total),
+            mimetype=EXPORT_FORMATS[fmt],
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
         )
         
     except Exception as e:
@@ -477,27 +769,49 @@ def export_cdks():
 
 @admin_bp.route('/api/cleanup', methods=['DELETE'])
 def cleanup_used_cdks():
-    """删除已使用的CDK"""
+    """删除已使用的CDK
+
+    查询参数：older_than_days（只删除指定天数之前使用的CDK）、
+    archive（table或jsonl，删除前先归档）
+    """
     try:
-        used_cdks = CDK.query.filter_by(is_used=True).all()
-        
-        if not used_cdks:
-            return jsonify({'status': 'success', 'message': '没有已使用的CDK需要删除'}), 200
-        
-        count = len(used_cdks)
-        
-        for cdk in used_cdks:
-            db.session.delete(cdk)
-        
-        db.session.commit()
-        
-        return jsonify({
+        archive = request.args.get('archive') or None
+        if archive not in (None,) + ARCHIVE_MODES:
+            return jsonify({'status': 'error', 'message': 'archive只能为table或jsonl'}), 400
+        
+        older_than = None
+        if request.args.get('older_than_days'):
+            try:
+                days = float(request.args['older_than_days'])
+            except ValueError:
+                return jsonify({'status': 'error', 'message': 'older_than_days必须是数字'}), 400
+            older_than = datetime.utcnow() - timedelta(days=days)
+        
+        archive_file = None
+        if archive == 'jsonl':
+            archive_dir = current_app.config['ARCHIVE_DIR']
+            os.makedirs(archive_dir, exist_ok=True)
+            archive_file = os.path.join(archive_dir, f'cdks_{datetime.now().strftime("%Y%m%d_%H%M%S")}.jsonl')
+        
+        count = delete_used_cdks_in_chunks(db.engine, older_than=older_than, archive=archive, archive_file=archive_file)
+        
+        if not count:
+            return jsonify({'status': 'success', 'message': '没有已使用的CDK需要删除', 'removed': 0}), 200
+        
+        # 被删除的CDK不再授权对应设备：本进程立即清空缓存，
+        # 其他工作进程在读到新的auth_revision后清空（见AuthCacheSync）
+        device_auth_cache.clear()
+        
+        result = {
             'status': 'success',
-            'message': f'成功删除 {count} 个已使用的CDK'
-        }), 200
+            'message': f'成功删除 {count} 个已使用的CDK',
+            'removed': count
+        }
+        if archive_file:
+            result['archive_file'] = os.path.basename(archive_file)
+        return jsonify(result), 200
         
     except Exception as e:
-        db.session.rollback()
         return jsonify({'status': 'error', 'message': f'删除失败: {str(e)}'}), 500
 
 @admin_bp.route('/api/upload', methods=['POST'])
@@ -535,29 +849,124 @@ def upload_file():
         # 安全的文件名
         filename = secure_filename(file.filename)
         
-        # 确保files目录存在
-        files_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'files')
-        os.makedirs(files_dir, exist_ok=True)
+        # 边读取边计算哈希保存到内容寻址存储，完成后再发布文件名
+        files_dir = current_app.config['FILES_DIR']
+        store = BlobStore(files_dir)
+        sha256, file_size = store.put_stream(file.stream)
+        file_id = publish_file(files_dir, store, filename, sha256, file_size)
+        
+        return jsonify({
+            'status': 'success',
+            'message': f'文件 "{filename}" 上传成功 ({format_file_size(file_size)})',
+            'file_id': file_id,
+            'filename': filename,
+            'size': file_size,
+            'sha256': sha256
+        }), 200
         
-        # 保存文件
-        file_path = os.path.join(files_dir, filename)
-        file.save(file_path)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'上传失败: {str(e)}'}), 500
+
+@admin_bp.route('/api/uploads', methods=['POST'])
+def create_chunked_upload():
+    """创建分块上传会话"""
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(data.get('filename', ''))
+        size = data.get('size')
         
-        # 格式化文件大小
-        if file_size < 1024:
-            size_str = f"{file_size} B"
-        elif file_size < 1024 * 1024:
-            size_str = f"{file_size / 1024:.1f} KB"
-        else:
-            size_str = f"{file_size / (1024 * 1024):.1f} MB"
+        if not filename:
+            return jsonify({'status': 'error', 'message': '没有选择文件'}), 400
+        if not allowed_file(filename):
+            return jsonify({
+                'status': 'error',
+                'message': f'不支持的文件类型。支持的类型: {", ".join(ALLOWED_EXTENSIONS)}'
+            }), 400
+        if not isinstance(size, int):
+            return jsonify({'status': 'error', 'message': '文件大小格式错误'}), 400
+        
+        uploads_dir = uploads_dir_for(current_app.config['FILES_DIR'])
+        meta = create_upload(uploads_dir, filename, size)
+        
+        return jsonify({
+            'status': 'success',
+            'upload_id': meta['upload_id'],
+            'chunk_size': meta['chunk_size'],
+            'offset': 0
+        }), 201
+        
+    except UploadError as e:
+        return jsonify({'status': 'error', 'message': e.message}), e.status_code
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'上传失败: {str(e)}'}), 500
+
+@admin_bp.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_chunked_upload(upload_id):
+    """查询分块上传进度，用于断点续传"""
+    try:
+        meta = load_upload(uploads_dir_for(current_app.config['FILES_DIR']), upload_id)
+        return jsonify({
+            'status': 'success',
+            'upload_id': upload_id,
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'chunk_size': meta['chunk_size'],
+            'offset': meta['offset']
+        }), 200
+        
+    except UploadError as e:
+        return jsonify({'status': 'error', 'message': e.message}), e.status_code
+
+@admin_bp.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_upload_chunk(upload_id, index):
+    """上传一个数据块，请求体为原始字节，可带Upload-Offset头校验偏移量"""
+    try:
+        offset = request.headers.get('Upload-Offset')
+        offset = int(offset) if offset is not None else None
+        
+        received = write_chunk(
+            uploads_dir_for(current_app.config['FILES_DIR']),
+            upload_id, index, request.stream, offset
+        )
+        return jsonify({'status': 'success', 'offset': received}), 200
+        
+    except UploadError as e:
+        return jsonify({'status': 'error', 'message': e.message}), e.status_code
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Upload-Offset格式错误'}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'上传失败: {str(e)}'}), 500
+
+@admin_bp.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """完成分块上传，文件移入内容寻址存储并原子地发布"""
+    try:
+        files_dir = current_app.config['FILES_DIR']
+        store = BlobStore(files_dir)
+        filename, sha256, size = finalize_upload(uploads_dir_for(files_dir), upload_id, store)
+        file_id = publish_file(files_dir, store, filename, sha256, size)
         
         return jsonify({
             'status': 'success',
-            'message': f'文件 "{filename}" 上传成功 ({size_str})',
+            'message': f'文件 "{filename}" 上传成功 ({format_file_size(size)})',
+            'file_id': file_id,
             'filename': filename,
-            'size': file_size
+            'size': size,
+            'sha256': sha256
         }), 200
         
+    except UploadError as e:
+        return jsonify({'status': 'error', 'message': e.message}), e.status_code
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'上传失败: {str(e)}'}), 500
 
+@admin_bp.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    """取消分块上传"""
+    try:
+        abort_upload(uploads_dir_for(current_app.config['FILES_DIR']), upload_id)
+        return jsonify({'status': 'success', 'message': '上传已取消'}), 200
+        
+    except UploadError as e:
+        return jsonify({'status': 'error', 'message': e.message}), e.status_code
+
@@ -1,17 +1,48 @@
-from flask import Blueprint, request, jsonify, send_file, current_app
+from flask import Blueprint, request, jsonify, current_app
 from src.models.cdk import CDK, db
-import os
-import secrets
-import string
+from src.models.file import File
+from src.models.cdk_store import create_cdks, list_cdks_page, LIST_PAGE_SIZE
+from src.utils.bandwidth import downloads
+from src.utils.download_token import (
+    issue_download_token, verify_download_token, download_tokens_enabled, DOWNLOAD_TOKEN_TTL
+)
+from src.utils.file_catalog import get_file_catalog
+from src.utils.ranged_file import send_ranged_file, send_offloaded_file
+from src.utils.rate_limit import rate_limited
 from datetime import datetime
 
 cdk_bp = Blueprint('cdk', __name__)
 
-def generate_cdk_code():
-    """生成随机CDK码"""
-    return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(16))
+# 单次请求允许生成的最大CDK数量
+MAX_GENERATE_COUNT = 1000000
+# 响应中直接返回CDK列表的数量上限
+RETURN_CODES_LIMIT = 1000
+
+def _file_ref(entry):
+    """下载令牌中的文件标识：已登记的文件用id，直接放在目录中的文件用文件名"""
+    return entry.file_id if entry.file_id is not None else entry.name
+
+def _default_entry(catalog, entitlements):
+    """没有指定文件的CDK（旧版CDK）可下载的默认文件
+
+    DEFAULT_FILE_ID优先，其次是登记第一个文件时固定的默认文件（files.is_default），
+    都没有或文件已不存在时使用目录中未登记的文件。默认文件不随CDK授权变化。
+    固定的默认文件id随设备授权缓存，不单独查询数据库。
+    """
+    default_file_id = current_app.config.get('DEFAULT_FILE_ID')
+    if default_file_id is None:
+        default_file_id = entitlements.default_file_id
+    entry = catalog.get_by_id(default_file_id) if default_file_id is not None else None
+    return entry or catalog.default()
+
+def _lookup_file(catalog, file_ref):
+    """按下载令牌中的文件标识查找文件"""
+    if isinstance(file_ref, int):
+        return catalog.get_by_id(file_ref)
+    return catalog.get(file_ref)
 
 @cdk_bp.route('/verify_cdk', methods=['POST'])
+@rate_limited
 def verify_cdk():
     """验证CDK并绑定设备"""
     try:
@@ -29,11 +60,43 @@ def verify_cdk():
         is_valid, message = CDK.verify_cdk(cdk_code, device_id)
         
         if is_valid:
-            return jsonify({
+            result = {
                 'status': 'success',
                 'message': message,
                 'download_url': '/api/download_file'
-            }), 200
+            }
+            # CDK授权的文件；没有指定文件的CDK可下载默认文件
+            catalog = get_file_catalog(current_app.config['FILES_DIR'])
+            file_ids = CDK.file_ids_for(cdk_code)
+            if file_ids:
+                entries = [catalog.get_by_id(file_id) for file_id in file_ids]
+            else:
+                entries = [_default_entry(catalog, CDK.device_entitlements(device_id))]
+            
+            # 为每个文件签发短期下载令牌，下载时无需再查询数据库；
+            # 未配置签名密钥时不签发令牌，客户端使用Device-ID下载
+            use_tokens = download_tokens_enabled()
+            files = []
+            for entry in entries:
+                if entry is None:
+                    continue
+                item = {'id': entry.file_id, 'name': entry.name, 'size': entry.size}
+                if use_tokens:
+                    token = issue_download_token(device_id, _file_ref(entry))
+                    item['download_token'] = token
+                    item['download_url'] = f'/api/download_file?token={token}'
+                elif entry.file_id is not None:
+                    item['download_url'] = f'/api/download_file?file_id={entry.file_id}'
+                else:
+                    item['download_url'] = '/api/download_file'
+                files.append(item)
+            result['files'] = files
+            if files:
+                result['download_url'] = files[0]['download_url']
+                if use_tokens:
+                    result['download_token'] = files[0]['download_token']
+                    result['expires_in'] = DOWNLOAD_TOKEN_TTL
+            return jsonify(result), 200
         else:
             return jsonify({'status': 'error', 'message': message}), 400
             
@@ -45,24 +108,62 @@ def download_file():
     """下载文件"""
     try:
         device_id = request.headers.get('Device-ID', '').strip()
+        token = request.args.get('token') or request.headers.get('Download-Token', '')
+        catalog = get_file_catalog(current_app.config['FILES_DIR'])
         
-        if not device_id:
-            return jsonify({'status': 'error', 'message': '缺少设备ID'}), 400
-        
-        # 检查设备是否已授权
-        if not CDK.is_device_authorized(device_id):
-            return jsonify({'status': 'error', 'message': '设备未授权'}), 403
-        
-        # 查找压缩文件
-        files_dir = os.path.join(current_app.root_path, 'files')
-        if not os.path.exists(files_dir):
-            return jsonify({'status': 'error', 'message': '文件目录不存在'}), 404
+        if token and download_tokens_enabled():
+            # 使用下载令牌：只校验签名，不访问数据库
+            payload = verify_download_token(token)
+            if payload is None:
+                return jsonify({'status': 'error', 'message': '下载令牌无效或已过期'}), 403
+            token_device_id, file_ref = payload
+            if device_id and device_id != token_device_id:
+                return jsonify({'status': 'error', 'message': '下载令牌与设备不匹配'}), 403
+            device_id = token_device_id
+            entry = _lookup_file(catalog, file_ref)
+        else:
+            # 未启用下载令牌时忽略token参数，按Device-ID检查授权
+            if not device_id:
+                return jsonify({'status': 'error', 'message': '缺少设备ID'}), 400
+            
+            file_id = request.args.get('file_id')
+            if file_id is not None:
+                try:
+                    file_id = int(file_id)
+                except ValueError:
+                    return jsonify({'status': 'error', 'message': '文件ID格式错误'}), 400
+            
+            # 检查设备是否已授权
+            entitlements = CDK.device_entitlements(device_id)
+            if not entitlements.authorized:
+                return jsonify({'status': 'error', 'message': '设备未授权'}), 403
+            
+            # 从文件目录缓存中查找设备有权下载的文件
+            default = _default_entry(catalog, entitlements) if entitlements.unrestricted else None
+            if file_id is None:
+                # 未指定文件时下载默认文件或第一个授权的文件
+                entry = default
+                if entry is None:
+                    entries = (catalog.get_by_id(i) for i in sorted(entitlements.file_ids))
+                    entry = next((e for e in entries if e is not None), None)
+            elif file_id in entitlements.file_ids or (default is not None and default.file_id == file_id):
+                entry = catalog.get_by_id(file_id)
+            else:
+                return jsonify({'status': 'error', 'message': '设备无权下载该文件'}), 403
         
-        # 查找第一个压缩文件
-        for filename in os.listdir(files_dir):
-            if filename.lower().endswith(('.zip', '.rar', '.7z', '.tar.gz')):
-                file_path = os.path.join(files_dir, filename)
-                return send_file(file_path, as_attachment=True, download_name=filename)
+        if entry is not None:
+            offload = current_app.config.get('DOWNLOAD_OFFLOAD', 'direct')
+            if offload != 'direct':
+                # 授权完成后交给前端服务器发送文件，不占用Python工作进程
+                return send_offloaded_file(
+                    entry.path, entry.name, entry.content_type, offload,
+                    current_app.config['FILES_DIR'], current_app.config['DOWNLOAD_ACCEL_PREFIX']
+                )
+            return send_ranged_file(
+                entry.path, entry.name, entry.content_type,
+                size=entry.size, mtime=entry.mtime, etag=entry.etag,
+                pacer=downloads.pacer(entry.name, device_id, request.remote_addr)
+            )
         
         return jsonify({'status': 'error', 'message': '未找到可下载的文件'}), 404
         
@@ -75,30 +176,30 @@ def generate_cdk():
     try:
         data = request.get_json()
         count = data.get('count', 1) if data else 1
+        file_ids = data.get('file_ids') if data else None
         
-        if count <= 0 or count > 100:
-            return jsonify({'status': 'error', 'message': '生成数量必须在1-100之间'}), 400
-        
-        generated_cdks = []
+        if not isinstance(count, int) or count <= 0 or count > MAX_GENERATE_COUNT:
+            return jsonify({'status': 'error', 'message': f'生成数量必须在1-{MAX_GENERATE_COUNT}之间'}), 400
         
-        for _ in range(count):
-            # 生成唯一的CDK码
-            while True:
-                cdk_code = generate_cdk_code()
-                existing = CDK.query.filter_by(cdk_code=cdk_code).first()
-                if not existing:
-                    break
-            
-            # 创建新的CDK记录
-            new_cdk = CDK(cdk_code=cdk_code)
-            db.session.add(new_cdk)
-            generated_cdks.append(cdk_code)
+        # 指定file_ids时生成的CDK只能下载这些文件
+        if file_ids:
+            if not isinstance(file_ids, list) or not all(isinstance(i, int) for i in file_ids):
+                return jsonify({'status': 'error', 'message': '文件ID格式错误'}), 400
+            file_ids = sorted(set(file_ids))
+            found = File.query.filter(File.id.in_(file_ids)).count()
+            if found != len(file_ids):
+                return jsonify({'status': 'error', 'message': '文件不存在'}), 400
         
-        db.session.commit()
+        # 数量较少时才在响应中返回CDK列表，大批量请使用导出功能
+        return_codes = count <= RETURN_CODES_LIMIT
+        inserted, generated_cdks = create_cdks(
+            db.engine, count, return_codes=return_codes, file_ids=file_ids or None
+        )
         
         return jsonify({
             'status': 'success',
-            'message': f'成功生成{count}个CDK',
+            'message': f'成功生成{inserted}个CDK',
+            'count': inserted,
             'cdks': generated_cdks
         }), 200
         
@@ -108,18 +209,41 @@ def generate_cdk():
 
 @cdk_bp.route('/list_cdks', methods=['GET'])
 def list_cdks():
-    """列出所有CDK（管理员功能）"""
+    """分页列出CDK（管理员功能）
+
+    查询参数：cursor、limit、status(used/unused)、
+    created_from、created_to、used_from、used_to（ISO日期时间）
+    """
     try:
-        cdks = CDK.query.order_by(CDK.created_at.desc()).all()
+        args = request.args
+        status = args.get('status') or None
+        if status not in (None, 'used', 'unused'):
+            return jsonify({'status': 'error', 'message': 'status只能为used或unused'}), 400
+        
+        try:
+            limit = int(args.get('limit', LIST_PAGE_SIZE))
+            filters = {
+                name: datetime.fromisoformat(args[name]) if args.get(name) else None
+                for name in ('created_from', 'created_to', 'used_from', 'used_to')
+            }
+            cdks, next_cursor = list_cdks_page(
+                db.engine, cursor=args.get('cursor'), limit=limit, status=status, **filters
+            )
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': f'参数错误: {str(e)}'}), 400
+        
         return jsonify({
             'status': 'success',
-            'cdks': [cdk.to_dict() for cdk in cdks]
+            'cdks': cdks,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
         }), 200
         
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'服务器错误: {str(e)}'}), 500
 
 @cdk_bp.route('/check_device', methods=['POST'])
+@rate_limited
 def check_device():
     """检查设备授权状态"""
     try:
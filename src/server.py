@@ -0,0 +1,228 @@
+"""
+生产环境多进程启动器
+
+    python src/server.py --workers 4 --port 5001
+
+主进程预加载应用并监听端口，然后fork出多个工作进程共享同一个监听socket；
+每个工作进程用有上限的线程池处理请求，线程用完时新连接在内核的监听队列中
+排队。工作进程退出后自动重启。
+
+信号：
+    SIGHUP          逐个替换工作进程（先启动新进程再让旧进程处理完请求后退出）。
+                    新进程从主进程fork，使用主进程启动时加载的代码、配置和静态文件，
+                    只用于回收工作进程；部署新版本需要完全重启
+    SIGTERM/SIGINT  等待进行中的请求完成后退出
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+# 工作进程数，默认等于CPU核数
+WORKERS = int(os.environ.get('WORKERS', str(os.cpu_count() or 1)))
+# 每个工作进程同时处理的最大请求数
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', '32'))
+# 监听队列长度
+LISTEN_BACKLOG = int(os.environ.get('LISTEN_BACKLOG', '2048'))
+# 工作进程收到退出信号后等待进行中请求完成的最长时间（秒）
+GRACEFUL_TIMEOUT = float(os.environ.get('GRACEFUL_TIMEOUT', '30'))
+
+
+class RequestHandler(WSGIRequestHandler):
+    # 每个连接只处理一个请求，空闲的keep-alive连接不会占用并发名额
+    protocol_version = 'HTTP/1.0'
+
+
+class BoundedWSGIServer(ThreadedWSGIServer):
+    """每个请求一个线程，但同时处理的请求数有上限
+
+    线程数达到上限时不再accept，新连接留在监听队列中，而不是无限制地创建线程。
+    """
+
+    # 退出时等待进行中的请求完成
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, host, port, app, fd, max_threads):
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self._slots = threading.BoundedSemaphore(max_threads)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+
+def create_listener(host, port, backlog):
+    """在主进程中创建监听socket，由所有工作进程共享"""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    listener.set_inheritable(True)
+    return listener
+
+
+def run_worker(app, db, listener, host, port, threads):
+    """工作进程：重置继承自主进程的数据库连接后开始处理请求"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    with app.app_context():
+        # 连接池中的连接不能跨进程使用，丢弃但不关闭主进程的连接
+        db.engine.dispose(close=False)
+
+    server = BoundedWSGIServer(host, port, app, listener.fileno(), threads)
+
+    def stop(signum, frame):
+        # shutdown()会等待serve_forever退出，不能在其所在线程中直接调用
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+    server.server_close()
+
+
+class Arbiter:
+    """主进程：启动、监控和替换工作进程"""
+
+    def __init__(self, app, db, listener, host, port, workers, threads):
+        self.app = app
+        self.db = db
+        self.listener = listener
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.pids = set()
+        # 正在退出的旧进程及其强制结束时间
+        self.retiring = {}
+        self.reload_requested = False
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app, self.db, self.listener, self.host, self.port, self.threads)
+            except BaseException:
+                code = 1
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        self.pids.add(pid)
+        return pid
+
+    def retire(self, pid):
+        """让工作进程处理完当前请求后退出，超时后强制结束"""
+        self.pids.discard(pid)
+        self.retiring[pid] = time.monotonic() + GRACEFUL_TIMEOUT
+        self._kill(pid, signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self._on_hup)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        # 预加载阶段（检查数据库结构等）打开的连接不能被工作进程继承使用
+        with self.app.app_context():
+            self.db.engine.dispose()
+
+        for _ in range(self.workers):
+            self.spawn()
+        print(f'监听 {self.host}:{self.port}，{self.workers} 个工作进程，'
+              f'每个最多 {self.threads} 个并发请求', file=sys.stderr)
+
+        while not self.stopping or self.pids or self.retiring:
+            if self.stopping:
+                for pid in list(self.pids):
+                    self.retire(pid)
+            elif self.reload_requested:
+                self.reload_requested = False
+                self._reload()
+            self._reap()
+            self._kill_overdue()
+            if not self.stopping:
+                while len(self.pids) < self.workers:
+                    self.spawn()
+            time.sleep(0.2)
+
+    def _reload(self):
+        """逐个替换工作进程，监听socket始终有进程在accept
+
+        新进程从主进程fork，不会重新导入应用：代码、环境变量和静态文件清单
+        都与主进程启动时相同，部署新版本需要完全重启。
+        """
+        for pid in list(self.pids):
+            self.spawn()
+            self.retire(pid)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.pids and not self.stopping:
+                print(f'工作进程 {pid} 意外退出 (状态 {status})，重新启动', file=sys.stderr)
+            self.pids.discard(pid)
+            self.retiring.pop(pid, None)
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now > deadline:
+                self._kill(pid, signal.SIGKILL)
+
+    @staticmethod
+    def _kill(pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _on_hup(self, signum, frame):
+        self.reload_requested = True
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程生产环境服务器')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'), help='监听地址')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5001)), help='监听端口')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='工作进程数（默认CPU核数）')
+    parser.add_argument('--threads', type=int, default=WORKER_THREADS, help='每个工作进程的最大并发请求数')
+    parser.add_argument('--backlog', type=int, default=LISTEN_BACKLOG, help='监听队列长度')
+    args = parser.parse_args()
+
+    # 在主进程中预加载应用，工作进程fork后直接共享已加载的代码
+    from src.main import app
+    from src.models.user import db
+
+    listener = create_listener(args.host, args.port, args.backlog)
+    Arbiter(app, db, listener, args.host, args.port, args.workers, args.threads).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import itertools
+import os
+import threading
+import time
+
+# 单个下载的带宽上限（字节/秒），为0时不限制
+DOWNLOAD_RATE_LIMIT = int(os.environ.get('DOWNLOAD_RATE_LIMIT', '0'))
+# 所有下载合计的带宽上限（字节/秒），按最大最小公平原则分配给进行中的下载，为0时不限制
+DOWNLOAD_GLOBAL_RATE_LIMIT = int(os.environ.get('DOWNLOAD_GLOBAL_RATE_LIMIT', '0'))
+# 计算实时速率的时间窗口（秒），也是重新分配全局带宽的间隔
+THROUGHPUT_WINDOW = 1.0
+# 实际速率低于分配速率的该比例时，认为下载受客户端网速等其他因素限制
+SATURATION_RATIO = 0.9
+# 受其他因素限制的下载按实际速率的该倍数分配，留出提速的余地
+DEMAND_HEADROOM = 1.25
+# 每个下载至少分配平均份额的该比例，暂停读取的客户端恢复时不需要等待过久
+MIN_SHARE_RATIO = 0.1
+# 令牌桶容量对应的时间（秒），决定速率限制下允许的突发量
+BURST_SECONDS = 0.25
+
+
+class DownloadPacer:
+    """按令牌桶控制单个下载的发送速度，并记录吞吐量
+
+    每次发送前调用throttle()（异步代码中等待delay()返回的秒数），令牌
+    不足时等待。速率由DownloadRegistry.fair_share()分配，不超过单个下载
+    的上限；设置了全局上限时，其他下载用不完的份额会分给这个下载。
+    """
+
+    def __init__(self, registry, name, device_id=None, remote_addr=None):
+        self.registry = registry
+        self.name = name
+        self.device_id = device_id
+        self.remote_addr = remote_addr
+        self.id = None
+        self.started_at = None
+        self.bytes_sent = 0
+        self.current_rate = 0.0
+        # 最近两次分配的速率，用于判断实际速率是否受分配的速率限制
+        self.allocated_rate = 0.0
+        self.previous_allocated_rate = 0.0
+        self._tokens = 0.0
+        self._refilled_at = None
+        self._window_start = None
+        self._window_bytes = 0
+        self._measured = False
+
+    def start(self):
+        now = time.monotonic()
+        self.started_at = time.time()
+        self._refilled_at = now
+        self._window_start = now
+        self.registry.register(self)
+
+    def finish(self):
+        self.registry.unregister(self)
+
+    def rate_limit(self):
+        """当前允许的速率（字节/秒），0表示不限制"""
+        return self.registry.fair_share(self)
+
+    def recent_rate(self, now):
+        """最近的实际速率，还没有完整的统计窗口时返回None
+
+        长时间没有发送（如客户端停止读取）时按当前窗口计算。
+        """
+        elapsed = now - self._window_start
+        if elapsed > 2 * THROUGHPUT_WINDOW:
+            return self._window_bytes / elapsed
+        return self.current_rate if self._measured else None
+
+    def throttle(self, nbytes):
+        """发送nbytes前调用，必要时在当前线程中等待"""
+        wait = self.delay(nbytes)
+        if wait:
+            time.sleep(wait)
+
+    def delay(self, nbytes):
+        """登记即将发送的nbytes，返回发送前需要等待的秒数（供异步发送使用）"""
+        rate = self.rate_limit()
+        now = time.monotonic()
+        wait = 0
+        if rate:
+            burst = max(rate * BURST_SECONDS, nbytes)
+            self._tokens = min(burst, self._tokens + (now - self._refilled_at) * rate)
+            self._refilled_at = now
+            self._tokens -= nbytes
+            if self._tokens < 0:
+                wait = -self._tokens / rate
+                # 等待结束时令牌恰好用完
+                self._tokens = 0.0
+                self._refilled_at = now + wait
+        self._record(nbytes, now + wait)
+        return wait
+
+    def _record(self, nbytes, now):
+        self.registry.add_bytes(nbytes)
+        self.bytes_sent += nbytes
+        self._window_bytes += nbytes
+        elapsed = now - self._window_start
+        if elapsed >= THROUGHPUT_WINDOW:
+            self.current_rate = self._window_bytes / elapsed
+            self._measured = True
+            self._window_start = now
+            self._window_bytes = 0
+
+    def to_dict(self):
+        elapsed = time.time() - self.started_at
+        return {
+            'id': self.id,
+            'name': self.name,
+            'device_id': self.device_id,
+            'remote_addr': self.remote_addr,
+            'started_at': self.started_at,
+            'bytes_sent': self.bytes_sent,
+            'current_rate': round(self.current_rate),
+            'average_rate': round(self.bytes_sent / elapsed) if elapsed > 0 else 0,
+            'rate_limit': self.rate_limit(),
+        }
+
+
+class DownloadRegistry:
+    """进行中的下载（进程内），用于分配全局带宽和查看实时吞吐量"""
+
+    def __init__(self, rate_limit=DOWNLOAD_RATE_LIMIT, global_rate_limit=DOWNLOAD_GLOBAL_RATE_LIMIT):
+        self.rate_limit = rate_limit
+        self.global_rate_limit = global_rate_limit
+        # 进程启动以来所有下载发送的字节数
+        self.bytes_sent = 0
+        self._active = {}
+        # 每个下载分配到的速率，每隔THROUGHPUT_WINDOW或下载开始、结束时重新计算
+        self._shares = {}
+        self._shares_at = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def pacer(self, name, device_id=None, remote_addr=None):
+        """为一次下载创建DownloadPacer，开始发送时才登记"""
+        return DownloadPacer(self, name, device_id, remote_addr)
+
+    def register(self, pacer):
+        with self._lock:
+            pacer.id = next(self._ids)
+            self._active[pacer.id] = pacer
+            self._shares_at = None
+
+    def unregister(self, pacer):
+        with self._lock:
+            self._active.pop(pacer.id, None)
+            self._shares_at = None
+
+    def add_bytes(self, nbytes):
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def active_count(self):
+        return len(self._active)
+
+    def fair_share(self, pacer):
+        """下载当前允许的速率（字节/秒），0表示不限制"""
+        if not self.global_rate_limit:
+            return self.rate_limit
+        now = time.monotonic()
+        with self._lock:
+            if self._shares_at is None or now - self._shares_at >= THROUGHPUT_WINDOW:
+                self._rebalance(now)
+                self._shares_at = now
+            share = self._shares.get(pacer.id)
+        if share is None:
+            # 尚未登记的下载
+            share = self.global_rate_limit / max(len(self._active), 1)
+            return min(self.rate_limit, share) if self.rate_limit else share
+        return share
+
+    def _rebalance(self, now):
+        """按最大最小公平原则分配全局带宽（调用方持有锁）
+
+        实际速率明显低于所分配速率的下载（受客户端网速等限制）只分配略高于
+        实际速率的带宽；其余下载的需求视为单个下载的上限（未设置时不限），
+        按需求从小到大依次分配，前面的下载用不完的带宽由后面的下载平分。
+        """
+        demands = []
+        min_share = self.global_rate_limit / max(len(self._active), 1) * MIN_SHARE_RATIO
+        for pacer in self._active.values():
+            demand = self.rate_limit or None
+            # 分配变化后的第一个窗口内，实际速率仍受之前的分配限制
+            allocated = min(pacer.allocated_rate, pacer.previous_allocated_rate)
+            rate = pacer.recent_rate(now)
+            if allocated and rate is not None and rate < allocated * SATURATION_RATIO:
+                limited = max(rate * DEMAND_HEADROOM, min_share)
+                demand = min(demand, limited) if demand else limited
+            demands.append((demand, pacer))
+        demands.sort(key=lambda item: float('inf') if item[0] is None else item[0])
+
+        remaining = self.global_rate_limit
+        shares = {}
+        for index, (demand, pacer) in enumerate(demands):
+            share = remaining / (len(demands) - index)
+            if demand is not None and demand < share:
+                share = demand
+            remaining -= share
+            shares[pacer.id] = share
+            pacer.previous_allocated_rate = pacer.allocated_rate or share
+            pacer.allocated_rate = share
+        self._shares = shares
+
+    def snapshot(self):
+        """进行中下载的吞吐量"""
+        with self._lock:
+            active = list(self._active.values())
+        downloads = [pacer.to_dict() for pacer in active]
+        return {
+            'active': len(downloads),
+            'rate_limit': self.rate_limit,
+            'global_rate_limit': self.global_rate_limit,
+            'current_rate': sum(d['current_rate'] for d in downloads),
+            'downloads': downloads,
+        }
+
+
+# 进程内的下载登记表
+downloads = DownloadRegistry()
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，索引更新只在单进程内安全
+    fcntl = None
+
+# 流式读取/哈希时的块大小
+READ_SIZE = 1024 * 1024
+
+
+class BlobWriter:
+    """边写入边计算SHA-256的临时文件"""
+
+    def __init__(self, store):
+        self.store = store
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.tmp_dir, suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self._hash.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def commit(self):
+        """写入完成，返回(sha256, 大小)"""
+        self._file.close()
+        sha256 = self._hash.hexdigest()
+        self.store._adopt(self.tmp_path, sha256)
+        return sha256, self.size
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class BlobStore:
+    """按内容寻址的文件存储
+
+    文件内容以SHA-256命名保存在.blobs目录下，相同内容只保存一份；
+    .index.json记录文件名到内容哈希的映射，发布时原子地替换整个索引。
+    已发布的内容不会被覆盖，正在下载旧版本的请求不受新版本发布影响。
+    """
+
+    def __init__(self, files_dir):
+        self.files_dir = files_dir
+        self.blobs_dir = os.path.join(files_dir, '.blobs')
+        self.tmp_dir = os.path.join(self.blobs_dir, 'tmp')
+        self.index_path = os.path.join(files_dir, '.index.json')
+        self._lock_path = os.path.join(self.blobs_dir, '.index.lock')
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_dir, sha256[:2], sha256)
+
+    @contextmanager
+    def writer(self):
+        """获取BlobWriter，出错时自动删除临时文件"""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        writer = BlobWriter(self)
+        try:
+            yield writer
+        except BaseException:
+            writer.discard()
+            raise
+
+    def put_stream(self, stream):
+        """从流中读取内容并保存，返回(sha256, 大小)"""
+        with self.writer() as writer:
+            while True:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+            return writer.commit()
+
+    def put_file(self, path):
+        """将已在同一文件系统上的文件移入存储，返回(sha256, 大小)"""
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+                size += len(data)
+        sha256 = digest.hexdigest()
+        self._adopt(path, sha256)
+        return sha256, size
+
+    def _adopt(self, path, sha256):
+        """将临时文件放到内容哈希对应的位置，内容已存在时直接丢弃"""
+        target = self.blob_path(sha256)
+        if os.path.exists(target):
+            os.remove(path)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.chmod(path, 0o644)
+        os.replace(path, target)
+
+    def read_index(self):
+        """读取文件名索引"""
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def publish(self, name, sha256, size, content_type, file_id=None):
+        """将文件名指向新内容（原子替换索引），file_id为对应的File记录"""
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        with self._index_lock():
+            index = self.read_index()
+            index[name] = {
+                'sha256': sha256,
+                'size': size,
+                'content_type': content_type,
+                'published_at': time.time(),
+                'file_id': file_id,
+            }
+            fd, tmp_path = tempfile.mkstemp(dir=self.files_dir, prefix='.index.', suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+
+    @contextmanager
+    def _index_lock(self):
+        """跨进程互斥地更新索引"""
+        with open(self._lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,153 @@
+import json
+import os
+import re
+import secrets
+import time
+
+# 分块上传的块大小（字节）
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+# 分块上传允许的最大文件大小（字节）
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', str(8 * 1024 * 1024 * 1024)))
+# 未完成的上传会话保留时间（秒）
+UPLOAD_SESSION_TTL = 24 * 3600
+# 从请求体读取数据的块大小
+READ_SIZE = 64 * 1024
+
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(Exception):
+    """上传请求错误，携带应返回的HTTP状态码"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def uploads_dir_for(files_dir):
+    """上传临时目录，与文件存储在同一文件系统上以保证重命名是原子的"""
+    return os.path.join(files_dir, '.uploads')
+
+
+def _paths(uploads_dir, upload_id):
+    if not _UPLOAD_ID_RE.match(upload_id):
+        raise UploadError('上传会话不存在', 404)
+    base = os.path.join(uploads_dir, upload_id)
+    return base + '.json', base + '.part'
+
+
+def create_upload(uploads_dir, filename, size):
+    """创建上传会话，返回会话信息"""
+    if size <= 0:
+        raise UploadError('文件大小必须大于0')
+    if size > MAX_UPLOAD_SIZE:
+        raise UploadError(f'文件大小超过限制 ({MAX_UPLOAD_SIZE // (1024 * 1024)}MB)')
+
+    os.makedirs(uploads_dir, exist_ok=True)
+    _expire_stale_uploads(uploads_dir)
+
+    upload_id = secrets.token_hex(16)
+    meta = {
+        'upload_id': upload_id,
+        'filename': filename,
+        'size': size,
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'created_at': time.time(),
+    }
+    meta_path, part_path = _paths(uploads_dir, upload_id)
+    open(part_path, 'wb').close()
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+    return meta
+
+
+def load_upload(uploads_dir, upload_id):
+    """读取上传会话，并附带已接收的字节数"""
+    meta_path, part_path = _paths(uploads_dir, upload_id)
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        meta['offset'] = os.path.getsize(part_path)
+    except FileNotFoundError:
+        raise UploadError('上传会话不存在', 404)
+    return meta
+
+
+def write_chunk(uploads_dir, upload_id, index, stream, offset=None):
+    """将第index块写入临时文件，返回已接收的字节数
+
+    数据从stream逐段读取并写入，内存占用与块大小无关。块必须从
+    index * chunk_size开始，且不能超过已接收的位置（允许重传）。
+    """
+    meta = load_upload(uploads_dir, upload_id)
+    chunk_size = meta['chunk_size']
+    start = index * chunk_size
+    if offset is not None and offset != start:
+        raise UploadError(f'块偏移量错误，应为 {start}')
+    if index < 0 or start >= meta['size']:
+        raise UploadError('块序号超出文件范围')
+    if start > meta['offset']:
+        raise UploadError(f'缺少之前的数据块，当前偏移量 {meta["offset"]}', 409)
+
+    limit = min(chunk_size, meta['size'] - start)
+    is_tail = start + limit >= meta['offset']
+    _, part_path = _paths(uploads_dir, upload_id)
+    written = 0
+    with open(part_path, 'r+b') as f:
+        f.seek(start)
+        try:
+            while True:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    break
+                written += len(data)
+                if written > limit:
+                    raise UploadError(f'数据块大小超过限制 ({limit} 字节)')
+                f.write(data)
+            if written != limit:
+                raise UploadError(f'数据块不完整，期望 {limit} 字节，实际 {written} 字节')
+        except Exception:
+            # 丢弃不完整的末尾块，客户端可从start重传
+            if is_tail:
+                f.truncate(start)
+            raise
+
+    return max(meta['offset'], start + limit)
+
+
+def finalize_upload(uploads_dir, upload_id, store):
+    """校验上传完整后移入内容寻址存储，返回(文件名, sha256, 大小)"""
+    meta = load_upload(uploads_dir, upload_id)
+    if meta['offset'] != meta['size']:
+        raise UploadError(f'文件尚未上传完整 ({meta["offset"]}/{meta["size"]})', 409)
+
+    meta_path, part_path = _paths(uploads_dir, upload_id)
+    sha256, size = store.put_file(part_path)
+    os.remove(meta_path)
+    return meta['filename'], sha256, size
+
+
+def abort_upload(uploads_dir, upload_id):
+    """取消上传并删除临时文件"""
+    for path in _paths(uploads_dir, upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _expire_stale_uploads(uploads_dir):
+    """删除超过保留时间没有写入的未完成上传"""
+    deadline = time.time() - UPLOAD_SESSION_TTL
+    for entry in os.scandir(uploads_dir):
+        if not entry.name.endswith('.part'):
+            continue
+        try:
+            stale = entry.stat().st_mtime < deadline
+        except FileNotFoundError:
+            continue
+        if stale:
+            abort_upload(uploads_dir, entry.name[:-len('.part')])
@@ -0,0 +1,55 @@
+import os
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+# 下载令牌有效期（秒）
+DOWNLOAD_TOKEN_TTL = int(os.environ.get('DOWNLOAD_TOKEN_TTL', '600'))
+# 代码中公开的默认SECRET_KEY，任何人都能用它伪造令牌，不能用于签名
+DEFAULT_SECRET_KEY = 'asdf#FGSgvasgf$5$WGT'
+
+
+def download_token_secret(config):
+    """下载令牌的签名密钥
+
+    优先使用DOWNLOAD_TOKEN_SECRET（可独立于SECRET_KEY轮换），否则使用SECRET_KEY；
+    都没有配置或只有默认SECRET_KEY时返回None，此时不签发也不接受下载令牌。
+    """
+    secret = config.get('DOWNLOAD_TOKEN_SECRET') or config.get('SECRET_KEY')
+    if not secret or secret == DEFAULT_SECRET_KEY:
+        return None
+    return secret
+
+
+def download_tokens_enabled():
+    """是否配置了可用于签发下载令牌的密钥"""
+    return download_token_secret(current_app.config) is not None
+
+
+def _serializer():
+    secret = download_token_secret(current_app.config)
+    if secret is None:
+        raise RuntimeError('未配置SECRET_KEY或DOWNLOAD_TOKEN_SECRET，不能签发下载令牌')
+    return URLSafeTimedSerializer(secret, salt='download-token')
+
+
+def issue_download_token(device_id, file_id):
+    """签发绑定设备和文件的下载令牌"""
+    return _serializer().dumps({'d': device_id, 'f': file_id})
+
+
+def verify_download_token(token, max_age=None):
+    """校验下载令牌，成功返回(device_id, file_id)，失败返回None
+
+    只做签名和过期时间校验，不访问数据库。未配置签名密钥时一律返回None。
+    """
+    if not download_tokens_enabled():
+        return None
+    try:
+        payload = _serializer().loads(
+            token, max_age=DOWNLOAD_TOKEN_TTL if max_age is None else max_age
+        )
+    except BadSignature:
+        return None
+    if not isinstance(payload, dict) or 'd' not in payload or 'f' not in payload:
+        return None
+    return payload['d'], payload['f']
@@ -0,0 +1,159 @@
+import mimetypes
+import os
+import threading
+import time
+from collections import namedtuple
+from src.utils.blob_store import BlobStore
+from src.utils.ranged_file import make_etag
+
+# 可供下载的压缩文件扩展名
+DOWNLOAD_EXTENSIONS = ('.zip', '.rar', '.7z', '.tar.gz')
+# 检查目录变化的最小间隔（秒）
+CHECK_INTERVAL = float(os.environ.get('FILE_CATALOG_CHECK_INTERVAL', '1.0'))
+
+CatalogEntry = namedtuple('CatalogEntry', 'name path size mtime etag content_type file_id')
+
+
+def guess_content_type(filename):
+    """根据文件名推断Content-Type"""
+    content_type, encoding = mimetypes.guess_type(filename)
+    if encoding == 'gzip':
+        return 'application/gzip'
+    return content_type or 'application/octet-stream'
+
+
+class FileCatalog:
+    """可下载文件目录的进程内缓存
+
+    目录内容按文件名排序，附带预先计算好的大小、修改时间和Content-Type。
+    通过上传发布到内容寻址存储的文件以SHA-256作为ETag，并可按File记录的
+    id查找；直接放在目录中的文件同样可以下载（没有id），同名时以存储中的
+    版本为准。
+    上传接口通过invalidate()主动失效；应用外部的修改通过定期比较
+    目录和文件的mtime发现。
+    """
+
+    def __init__(self, files_dir, check_interval=CHECK_INTERVAL):
+        self.files_dir = files_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = []
+        self._by_name = {}
+        self._by_id = {}
+        self._signature = None
+        self._checked_at = None
+
+    def invalidate(self):
+        """使缓存失效，下次访问时重新扫描目录"""
+        with self._lock:
+            self._checked_at = None
+            self._signature = None
+
+    def entries(self):
+        """返回所有可下载文件"""
+        self._refresh_if_stale()
+        return self._entries
+
+    def get(self, name):
+        """按文件名查找"""
+        self._refresh_if_stale()
+        return self._by_name.get(name)
+
+    def get_by_id(self, file_id):
+        """按File记录的id查找"""
+        self._refresh_if_stale()
+        return self._by_id.get(file_id)
+
+    def default(self):
+        """返回直接放在目录中、没有登记File记录的文件中按文件名排序的第一个
+
+        登记过的文件可能只授权给部分CDK，不会被当作默认文件。
+        """
+        for entry in self.entries():
+            if entry.file_id is None:
+                return entry
+        return None
+
+    def _refresh_if_stale(self):
+        checked_at = self._checked_at
+        now = time.monotonic()
+        if checked_at is not None and now - checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return
+            signature = self._current_signature()
+            if signature != self._signature:
+                self._rebuild()
+                self._signature = self._current_signature()
+            self._checked_at = now
+
+    def _current_signature(self):
+        """目录及已知文件的mtime，任一变化都说明目录需要重建"""
+        try:
+            dir_mtime = os.stat(self.files_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        files = []
+        for entry in self._entries:
+            try:
+                stat = os.stat(entry.path)
+            except FileNotFoundError:
+                files.append(None)
+                continue
+            files.append((stat.st_size, stat.st_mtime_ns))
+        return dir_mtime, tuple(files)
+
+    def _rebuild(self):
+        store = BlobStore(self.files_dir)
+        entries = []
+        for name, item in store.read_index().items():
+            if not name.lower().endswith(DOWNLOAD_EXTENSIONS):
+                continue
+            entries.append(CatalogEntry(
+                name=name,
+                path=store.blob_path(item['sha256']),
+                size=item['size'],
+                mtime=item['published_at'],
+                etag=item['sha256'],
+                content_type=item['content_type'],
+                file_id=item.get('file_id'),
+            ))
+        published = {e.name for e in entries}
+        
+        try:
+            scanned = list(os.scandir(self.files_dir))
+        except FileNotFoundError:
+            scanned = []
+        for item in scanned:
+            if not item.name.lower().endswith(DOWNLOAD_EXTENSIONS) or item.name in published:
+                continue
+            if not item.is_file():
+                continue
+            stat = item.stat()
+            entries.append(CatalogEntry(
+                name=item.name,
+                path=item.path,
+                size=stat.st_size,
+                mtime=stat.st_mtime,
+                etag=make_etag(stat.st_size, stat.st_mtime_ns),
+                content_type=guess_content_type(item.name),
+                file_id=None,
+            ))
+        entries.sort(key=lambda e: e.name)
+        self._entries = entries
+        self._by_name = {e.name: e for e in entries}
+        self._by_id = {e.file_id: e for e in entries if e.file_id is not None}
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_file_catalog(files_dir):
+    """获取指定目录的文件目录缓存（每个目录一个实例）"""
+    catalog = _catalogs.get(files_dir)
+    if catalog is None:
+        with _catalogs_lock:
+            catalog = _catalogs.setdefault(files_dir, FileCatalog(files_dir))
+    return catalog
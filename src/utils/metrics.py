@@ -0,0 +1,200 @@
+import bisect
+import os
+import threading
+import time
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from src.utils.bandwidth import downloads
+
+# 请求耗时直方图的桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 数据库查询耗时直方图的桶（秒）
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器，按标签值分别计数"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield self.name + _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    """按固定的桶统计分布，输出累计计数、总和和次数"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            item = self._values.get(label_values)
+            if item is None:
+                item = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            item[0][index] += 1
+            item[1] += value
+            item[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._values.items()]
+        for label_values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = (('le', _format_value(float(bound))),)
+                yield self.name + '_bucket' + _format_labels(self.labels, label_values, le), cumulative
+            yield self.name + '_sum' + _format_labels(self.labels, label_values), total
+            yield self.name + '_count' + _format_labels(self.labels, label_values), count
+
+
+class Gauge:
+    """读取时通过回调取值的瞬时指标"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, callback):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def samples(self):
+        yield self.name, self.callback()
+
+
+class CallbackCounter(Gauge):
+    """读取时通过回调取值的计数器（计数保存在其他模块中）"""
+
+    type = 'counter'
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus文本格式"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, value in metric.samples():
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.register(Counter(
+    'http_requests_total', '按路由统计的请求数', ('endpoint', 'method', 'status')
+))
+http_latency = registry.register(Histogram(
+    'http_request_duration_seconds', '请求处理耗时（下载只统计到开始发送响应体）', ('endpoint',)
+))
+cdk_redemptions = registry.register(Counter(
+    'cdk_redemptions_total', 'CDK兑换结果', ('outcome',)
+))
+db_queries = registry.register(Histogram(
+    'db_query_duration_seconds', '数据库查询耗时', buckets=DB_BUCKETS
+))
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+
+
+def _after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        http_latency.observe(time.perf_counter() - started, endpoint)
+        http_requests.inc(endpoint, request.method, str(response.status_code))
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_query_started')
+    if started:
+        db_queries.observe(time.perf_counter() - started.pop())
+
+
+def _handle_db_error(context):
+    connection = context.connection
+    started = connection.info.get('metrics_query_started') if connection is not None else None
+    if started:
+        started.pop()
+
+
+def metrics_view():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_metrics(app):
+    """为应用注册请求计时、数据库查询计时和/metrics接口
+
+    指标保存在进程内，多进程部署时每次抓取只反映处理该请求的工作进程，
+    可以通过process_id区分。
+    """
+    registry.register(Gauge('process_id', '处理本次抓取的工作进程', os.getpid))
+    registry.register(Gauge('downloads_active', '进行中的下载数', downloads.active_count))
+    registry.register(CallbackCounter(
+        'download_bytes_total', '下载发送的字节数', lambda: downloads.bytes_sent
+    ))
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_db_error)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,124 @@
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import time
+from flask import g, request
+
+# 随机抽样分析的请求比例（0-1），为0时不抽样
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+# 请求头X-Profile等于该值时分析该请求，为空时不接受请求头
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+# 最多保留的分析结果文件数，超过时删除最旧的
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '200'))
+
+PROFILE_SUFFIX = '.prof'
+_PROFILE_NAME_RE = re.compile(r'^[\w.-]+\.prof$')
+
+
+def profiling_enabled():
+    return PROFILE_SAMPLE_RATE > 0 or bool(PROFILE_TOKEN)
+
+
+def _should_profile():
+    token = request.headers.get('X-Profile')
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _before_request():
+    if not _should_profile():
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 同一时刻只能有一个分析器（Python 3.12+），跳过本次
+        return
+    g.profiler = profiler
+    g.profile_started = time.perf_counter()
+
+
+def _save_profile(profile_dir, response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    elapsed_ms = int((time.perf_counter() - g.pop('profile_started')) * 1000)
+    endpoint = re.sub(r'[^\w.-]', '_', request.endpoint or 'unmatched')
+    name = f'{int(time.time() * 1000)}-{endpoint}-{elapsed_ms}ms{PROFILE_SUFFIX}'
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(profile_dir, name))
+    _rotate(profile_dir)
+    response.headers['X-Profile-File'] = name
+    return response
+
+
+def _discard_profile(exc):
+    """视图抛出异常、没有执行after_request时停止分析"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+
+
+def _rotate(profile_dir):
+    names = sorted(n for n in os.listdir(profile_dir) if n.endswith(PROFILE_SUFFIX))
+    for name in names[:max(len(names) - PROFILE_MAX_FILES, 0)]:
+        try:
+            os.remove(os.path.join(profile_dir, name))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles(profile_dir):
+    """列出分析结果，最新的在前"""
+    try:
+        names = [n for n in os.listdir(profile_dir) if n.endswith(PROFILE_SUFFIX)]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in sorted(names, reverse=True):
+        timestamp, _, rest = name[:-len(PROFILE_SUFFIX)].partition('-')
+        endpoint, _, duration = rest.rpartition('-')
+        profiles.append({
+            'name': name,
+            'endpoint': endpoint,
+            'duration_ms': int(duration[:-2]) if duration.endswith('ms') else None,
+            'created_at': int(timestamp) / 1000 if timestamp.isdigit() else None,
+            'size': os.path.getsize(os.path.join(profile_dir, name)),
+        })
+    return profiles
+
+
+def profile_path(profile_dir, name):
+    """分析结果文件路径，文件名不合法时返回None"""
+    if not _PROFILE_NAME_RE.match(name):
+        return None
+    path = os.path.join(profile_dir, name)
+    return path if os.path.isfile(path) else None
+
+
+def format_profile(path, sort='cumulative', limit=50):
+    """以文本形式输出分析结果中耗时最多的函数"""
+    out = io.StringIO()
+    stats = pstats.Stats(path, stream=out)
+    stats.sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+def init_profiler(app):
+    """按配置为应用注册请求分析钩子
+
+    PROFILE_SAMPLE_RATE和PROFILE_TOKEN都未设置时不注册任何钩子，没有额外开销。
+    分析结果（pstats格式，可用snakeviz等工具查看）写入app.config['PROFILE_DIR']。
+    """
+    if not profiling_enabled():
+        return
+    profile_dir = app.config['PROFILE_DIR']
+    app.before_request(_before_request)
+    app.after_request(lambda response: _save_profile(profile_dir, response))
+    app.teardown_request(_discard_profile)
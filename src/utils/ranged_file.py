@@ -0,0 +1,194 @@
+import mimetypes
+import os
+import secrets
+from datetime import datetime, timezone
+from flask import request, Response
+from urllib.parse import quote
+from werkzeug.http import http_date, is_resource_modified
+
+# 每次读取文件的块大小
+CHUNK_SIZE = 64 * 1024
+# 单个请求允许的最大区间数量，超过则忽略Range返回完整文件
+MAX_RANGES = 16
+# 下载发送方式：direct由Python发送，x-accel/x-sendfile交给前端服务器发送
+OFFLOAD_MODES = ('direct', 'x-accel', 'x-sendfile')
+
+
+def make_etag(size, mtime_ns):
+    """根据文件大小和修改时间生成强ETag"""
+    return f'{size:x}-{mtime_ns:x}'
+
+
+class FileRangeIterator:
+    """按片段流式读取文件
+
+    parts中的元素为bytes（直接输出）或(start, stop)区间（从文件读取）。
+    pacer不为空时，每块数据发送前由pacer控制速度并记录吞吐量。
+    """
+
+    def __init__(self, file_path, parts, chunk_size=CHUNK_SIZE, pacer=None):
+        self.file_path = file_path
+        self.parts = parts
+        self.chunk_size = chunk_size
+        self.pacer = pacer
+        self._file = None
+
+    def __iter__(self):
+        self._file = open(self.file_path, 'rb')
+        if self.pacer is not None:
+            self.pacer.start()
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            start, stop = part
+            self._file.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                data = self._file.read(min(self.chunk_size, remaining))
+                if not data:
+                    # 文件在传输过程中被截断
+                    return
+                remaining -= len(data)
+                if self.pacer is not None:
+                    self.pacer.throttle(len(data))
+                yield data
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if self.pacer is not None:
+                self.pacer.finish()
+
+
+def _resolve_ranges(byte_range, size):
+    """将Range头解析为文件内的区间列表，无可满足区间时返回空列表"""
+    resolved = []
+    for start, stop in byte_range.ranges:
+        if start < 0:
+            start = max(size + start, 0)
+            stop = size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            resolved.append((start, stop))
+    return resolved
+
+
+def _range_allowed(etag, last_modified):
+    """根据If-Range判断是否应当返回部分内容"""
+    if_range = request.if_range
+    if if_range.etag is None and if_range.date is None:
+        return True
+    if if_range.etag is not None:
+        # If-Range要求强校验，弱ETag永远不匹配
+        raw = request.headers.get('If-Range', '')
+        return not raw.startswith('W/') and if_range.etag == etag
+    return if_range.date == last_modified
+
+
+def send_ranged_file(file_path, download_name, mimetype=None,
+                     size=None, mtime=None, etag=None, pacer=None):
+    """发送文件，支持Range、If-Range、ETag和Last-Modified
+
+    size、mtime、etag可以由调用方预先计算好传入，避免每次请求都stat文件。
+    pacer用于限制发送速度，见src/utils/bandwidth.py。
+    """
+    if size is None or mtime is None:
+        stat = os.stat(file_path)
+        size = stat.st_size
+        mtime = stat.st_mtime
+        if etag is None:
+            etag = make_etag(size, stat.st_mtime_ns)
+    elif etag is None:
+        etag = make_etag(size, int(mtime * 1e9))
+
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    last_modified = datetime.fromtimestamp(int(mtime), tz=timezone.utc)
+
+    response = Response(mimetype=mimetype, direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    response.headers['Last-Modified'] = http_date(last_modified)
+    response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response.status_code = 304
+        return response
+
+    byte_range = request.range
+    ranges = []
+    if (byte_range is not None and byte_range.units == 'bytes'
+            and len(byte_range.ranges) <= MAX_RANGES
+            and _range_allowed(etag, last_modified)):
+        ranges = _resolve_ranges(byte_range, size)
+        if not ranges:
+            response.status_code = 416
+            response.headers['Content-Range'] = f'bytes */{size}'
+            response.headers.remove('Content-Disposition')
+            return response
+
+    if not ranges:
+        response.response = FileRangeIterator(file_path, [(0, size)], pacer=pacer)
+        response.content_length = size
+        return response
+
+    response.status_code = 206
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        response.response = FileRangeIterator(file_path, ranges, pacer=pacer)
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        response.content_length = stop - start
+        return response
+
+    # 多区间请求，返回multipart/byteranges
+    boundary = secrets.token_hex(16)
+    parts = []
+    length = 0
+    for start, stop in ranges:
+        header = (
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {mimetype}\r\n'
+            f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n'
+        ).encode('latin-1')
+        parts.append(header)
+        parts.append((start, stop))
+        length += len(header) + stop - start
+    trailer = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    parts.append(trailer)
+    length += len(trailer)
+
+    response.response = FileRangeIterator(file_path, parts, pacer=pacer)
+    response.headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    response.content_length = length
+    return response
+
+
+def send_offloaded_file(file_path, download_name, mimetype, mode, root, accel_prefix):
+    """只返回响应头，由前端服务器读取文件并处理Range和条件请求
+
+    x-accel模式返回X-Accel-Redirect（nginx），路径为accel_prefix加上文件
+    相对于root的路径；x-sendfile模式返回X-Sendfile（Apache/lighttpd），
+    值为文件的绝对路径。文件不在root中时抛出ValueError。
+    """
+    if mode not in ('x-accel', 'x-sendfile'):
+        raise ValueError(f'不支持的下载发送方式: {mode}')
+    root = os.path.abspath(root)
+    file_path = os.path.abspath(file_path)
+    if os.path.commonpath([root, file_path]) != root or file_path == root:
+        raise ValueError('文件不在下载目录中')
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    response = Response(mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    if mode == 'x-accel':
+        relative = os.path.relpath(file_path, root).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(relative)
+    else:
+        response.headers['X-Sendfile'] = file_path
+    return response
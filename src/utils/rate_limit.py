@@ -0,0 +1,208 @@
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, jsonify
+
+# 按客户端IP限流：每分钟补充的令牌数和桶容量（允许的突发请求数），为0时不限流
+RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', '60'))
+RATE_LIMIT_IP_BURST = int(os.environ.get('RATE_LIMIT_IP_BURST', '20'))
+# 按设备ID限流
+RATE_LIMIT_DEVICE_PER_MINUTE = float(os.environ.get('RATE_LIMIT_DEVICE_PER_MINUTE', '20'))
+RATE_LIMIT_DEVICE_BURST = int(os.environ.get('RATE_LIMIT_DEVICE_BURST', '10'))
+# 每个限流器最多保留的令牌桶数量，超过时淘汰最久未使用的
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+# memory：进程内限流；sqlite：同一主机上的多个工作进程通过SQLite文件共享限流状态
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower()
+RATE_LIMIT_SQLITE_PATH = os.environ.get(
+    'RATE_LIMIT_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'cdk_rate_limit.db')
+)
+# sqlite模式下每次请求清理过期令牌桶的概率
+PRUNE_PROBABILITY = 0.001
+
+
+def _refill(tokens, updated, now, rate, burst):
+    """按经过的时间补充令牌，返回(剩余令牌, 需要等待的秒数)，等待为0表示放行"""
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class TokenBucketLimiter:
+    """进程内令牌桶限流器（线程安全），令牌桶数量有上限，按LRU淘汰"""
+
+    def __init__(self, rate, burst, maxsize=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """消耗一个令牌，放行时返回0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens, retry_after = _refill(tokens, updated, now, self.rate, self.burst)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            if retry_after:
+                self.rejected += 1
+            return retry_after
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'keys': len(self._buckets), 'rejected': self.rejected}
+
+
+class SQLiteTokenBucketLimiter:
+    """保存在SQLite文件中的令牌桶限流器，同一主机上的多个进程共享限流状态
+
+    每次判断在一个BEGIN IMMEDIATE事务中读取并更新令牌桶；已经补满的令牌桶
+    与不存在等价，会被定期清理，令牌桶数量超过上限时淘汰最久未使用的。
+    """
+
+    def __init__(self, name, rate, burst, path=RATE_LIMIT_SQLITE_PATH, maxsize=RATE_LIMIT_MAX_KEYS):
+        self.table = f'buckets_{name}'
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        self.maxsize = maxsize
+        self.rejected = 0
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} '
+                '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            connection.execute(
+                f'CREATE INDEX IF NOT EXISTS ix_{self.table}_updated ON {self.table} (updated)'
+            )
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    def acquire(self, key):
+        """消耗一个令牌，放行时返回0，否则返回需要等待的秒数"""
+        now = time.time()
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                f'SELECT tokens, updated FROM {self.table} WHERE key = ?', (key,)
+            ).fetchone()
+            tokens, updated = row if row is not None else (self.burst, now)
+            tokens, retry_after = _refill(tokens, updated, now, self.rate, self.burst)
+            connection.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, tokens, updated) VALUES (?, ?, ?)',
+                (key, tokens, now)
+            )
+            if random.random() < PRUNE_PROBABILITY:
+                self._prune(connection, now)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if retry_after:
+            self.rejected += 1
+        return retry_after
+
+    def _prune(self, connection, now):
+        connection.execute(
+            f'DELETE FROM {self.table} WHERE updated < ?', (now - self.burst / self.rate,)
+        )
+        connection.execute(
+            f'DELETE FROM {self.table} WHERE key IN '
+            f'(SELECT key FROM {self.table} ORDER BY updated LIMIT '
+            f'max((SELECT count(*) FROM {self.table}) - ?, 0))',
+            (self.maxsize,)
+        )
+
+    def stats(self):
+        keys = self._connect().execute(f'SELECT count(*) FROM {self.table}').fetchone()[0]
+        return {'backend': 'sqlite', 'keys': keys, 'rejected': self.rejected}
+
+
+def make_limiter(name, per_minute, burst):
+    """按配置创建限流器，per_minute为0时返回None（不限流）"""
+    if per_minute <= 0:
+        return None
+    rate = per_minute / 60.0
+    if RATE_LIMIT_BACKEND == 'sqlite':
+        return SQLiteTokenBucketLimiter(name, rate, burst)
+    if RATE_LIMIT_BACKEND != 'memory':
+        raise ValueError(f'不支持的限流方式: {RATE_LIMIT_BACKEND}')
+    return TokenBucketLimiter(rate, burst)
+
+
+_limiters = None
+_limiters_lock = threading.Lock()
+
+
+def get_limiters():
+    """返回(IP限流器, 设备限流器)，首次使用时创建"""
+    global _limiters
+    if _limiters is None:
+        with _limiters_lock:
+            if _limiters is None:
+                _limiters = (
+                    make_limiter('ip', RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST),
+                    make_limiter('device', RATE_LIMIT_DEVICE_PER_MINUTE, RATE_LIMIT_DEVICE_BURST),
+                )
+    return _limiters
+
+
+def rate_limit_stats():
+    """各限流器的统计信息"""
+    ip_limiter, device_limiter = get_limiters()
+    return {
+        'ip': ip_limiter.stats() if ip_limiter else None,
+        'device': device_limiter.stats() if device_limiter else None,
+    }
+
+
+def _request_device_id():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return ''
+    device_id = data.get('device_id', '')
+    return device_id.strip() if isinstance(device_id, str) else ''
+
+
+def rate_limited(view):
+    """按客户端IP和请求中的device_id限流，超出时返回429和Retry-After
+
+    在视图函数之前执行，被拒绝的请求不会访问数据库。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        ip_limiter, device_limiter = get_limiters()
+        retry_after = 0
+        if ip_limiter is not None:
+            retry_after = ip_limiter.acquire(request.remote_addr or '')
+        if not retry_after and device_limiter is not None:
+            device_id = _request_device_id()
+            if device_id:
+                retry_after = device_limiter.acquire(device_id)
+        if retry_after:
+            response = jsonify({'status': 'error', 'message': '请求过于频繁，请稍后再试'})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(math.ceil(retry_after))
+            return response
+        return view(*args, **kwargs)
+    return wrapper
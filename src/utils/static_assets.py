@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from collections import namedtuple
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:
+    # 可选依赖，未安装时只生成gzip版本
+    brotli = None
+
+# 内容寻址的构建产物（如Vite生成的assets/index-BTiaIGg7.js）：
+# 只匹配assets/目录下文件名末尾恰好8位、不含连字符的哈希，普通文件名不会被永久缓存
+HASHED_NAME_RE = re.compile(r'^assets/.+-[A-Za-z0-9_]{8}\.[A-Za-z0-9]+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# 其他文件（index.html等）每次都用ETag确认是否有更新
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+# 超过该大小的文件不缓存在内存中，也不预压缩
+STATIC_MAX_INLINE_SIZE = int(os.environ.get('STATIC_MAX_INLINE_SIZE', str(4 * 1024 * 1024)))
+# 小于该大小的文件不压缩
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_TYPES = (
+    'application/javascript', 'application/json', 'application/manifest+json',
+    'application/xml', 'image/svg+xml', 'image/vnd.microsoft.icon', 'image/x-icon',
+)
+
+StaticEntry = namedtuple('StaticEntry', 'path mimetype etag cache_control body variants')
+
+
+def _compressible(mimetype):
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def _compress(body):
+    """生成压缩版本，返回{编码: 内容}，只保留明显变小的版本"""
+    variants = {}
+    candidates = [('gzip', lambda: gzip.compress(body, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        candidates.insert(0, ('br', lambda: brotli.compress(body, quality=11)))
+    for encoding, compress in candidates:
+        data = compress()
+        if len(data) < len(body) * 0.9:
+            variants[encoding] = data
+    return variants
+
+
+def make_static_entry(body, mimetype, cache_control=REVALIDATE_CACHE_CONTROL, path=None):
+    """为内存中的内容计算ETag和压缩版本，结果可交给serve_static发送"""
+    variants = {}
+    if len(body) >= MIN_COMPRESS_SIZE and _compressible(mimetype):
+        variants = _compress(body)
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    return StaticEntry(path, mimetype, etag, cache_control, body, variants)
+
+
+class StaticManifest:
+    """启动时构建的静态文件清单
+
+    每个文件只读取一次：内容（及gzip/brotli压缩版本）、Content-Type和ETag
+    都预先计算好，处理请求时不访问文件系统。文件名带内容哈希的构建产物
+    可以被浏览器永久缓存。清单在导入应用时构建一次，src/server.py的工作进程
+    从主进程fork时继承同一份清单，替换静态文件后需要完全重启才能生效。
+    """
+
+    def __init__(self, static_dir, index_name='index.html'):
+        self.static_dir = static_dir
+        self.index_name = index_name
+        self.entries = {}
+        if static_dir and os.path.isdir(static_dir):
+            self._build()
+
+    def _build(self):
+        for root, dirs, names in os.walk(self.static_dir):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, self.static_dir).replace(os.sep, '/')
+                self.entries[rel] = self._load(rel, path)
+
+    def _load(self, rel, path):
+        mimetype = mimetypes.guess_type(rel)[0] or 'application/octet-stream'
+        cache_control = (
+            IMMUTABLE_CACHE_CONTROL if HASHED_NAME_RE.search(rel) else REVALIDATE_CACHE_CONTROL
+        )
+
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size <= STATIC_MAX_INLINE_SIZE:
+                return make_static_entry(f.read(), mimetype, cache_control, path)
+            digest = hashlib.sha256()
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return StaticEntry(path, mimetype, digest.hexdigest()[:32], cache_control, None, {})
+
+    def lookup(self, path):
+        """按请求路径查找文件，找不到时返回index.html（单页应用的前端路由）"""
+        return self.entries.get(path) or self.entries.get(self.index_name)
+
+
+def _choose_encoding(entry):
+    accept = request.accept_encodings
+    for encoding in entry.variants:
+        if accept.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def serve_static(entry):
+    """按Accept-Encoding选择预压缩版本发送，If-None-Match命中时返回304"""
+    encoding = _choose_encoding(entry) if entry.variants else None
+    # 不同编码是不同的表示，需要不同的强ETag
+    etag = f'{entry.etag}-{encoding}' if encoding else entry.etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif entry.body is None:
+        response = send_file(entry.path, mimetype=entry.mimetype, conditional=False, etag=False)
+    else:
+        response = Response(entry.variants[encoding] if encoding else entry.body, mimetype=entry.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = entry.cache_control
+    if entry.variants:
+        response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,54 @@
+"""
+测试环境：应用在导入时读取环境变量，必须先指向临时目录中的数据库和下载目录
+再导入src.main。
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEST_DIR = tempfile.mkdtemp(prefix='cdk-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(TEST_DIR, 'app.db')}"
+os.environ['FILES_DIR'] = os.path.join(TEST_DIR, 'files')
+os.environ['SECRET_KEY'] = 'test-secret-key'
+# 测试从同一个IP发出大量请求，关闭限流
+os.environ['RATE_LIMIT_IP_PER_MINUTE'] = '0'
+os.environ['RATE_LIMIT_DEVICE_PER_MINUTE'] = '0'
+
+from src.main import app as flask_app  # noqa: E402
+from src.models.cdk import db  # noqa: E402
+from src.models.cdk_store import create_cdks  # noqa: E402
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def app():
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def files_dir(app):
+    return app.config['FILES_DIR']
+
+
+@pytest.fixture
+def make_cdks(app):
+    """生成CDK，返回CDK码列表"""
+    def make(count=1, file_ids=None):
+        with app.app_context():
+            _, codes = create_cdks(db.engine, count, return_codes=True, file_ids=file_ids)
+        return codes
+    return make
@@ -0,0 +1,52 @@
+import io
+
+from sqlalchemy import event
+
+from src.models.cdk import auth_cache_sync, db
+
+
+def test_granting_default_file_keeps_it_for_legacy_codes(client, make_cdks):
+    client.post('/admin/api/upload', data={'file': (io.BytesIO(b'game' * 100), 'game.zip')})
+
+    # 旧版CDK（没有指定文件）下载固定的默认文件
+    code = make_cdks()[0]
+    result = client.post('/api/verify_cdk', json={'cdk': code, 'device_id': 'legacy-device'}).get_json()
+    default = result['files'][0]
+    headers = {'Device-ID': 'legacy-device'}
+    assert client.get('/api/download_file', headers=headers).status_code == 200
+
+    # 之后为其他CDK授权默认文件，不影响已兑换的旧版CDK
+    response = client.post('/api/generate_cdk', json={'count': 1, 'file_ids': [default['id']]})
+    assert response.status_code == 200
+
+    response = client.get('/api/download_file', headers=headers)
+    assert response.status_code == 200
+    assert default['name'] in response.headers['Content-Disposition']
+    assert client.get(f"/api/download_file?file_id={default['id']}", headers=headers).status_code == 200
+
+    files = client.get('/admin/api/files').get_json()['files']
+    assert [f['id'] for f in files if f['is_default']] == [default['id']]
+
+
+def test_repeat_device_download_does_not_query_database(app, client, make_cdks, monkeypatch):
+    client.post('/admin/api/upload', data={'file': (io.BytesIO(b'cached' * 100), 'cached.zip')})
+    code = make_cdks()[0]
+    client.post('/api/verify_cdk', json={'cdk': code, 'device_id': 'cached-device'})
+    headers = {'Device-ID': 'cached-device'}
+    assert client.get('/api/download_file', headers=headers).status_code == 200
+
+    # 授权和默认文件都已缓存，在修订号检查间隔内重复下载不访问数据库
+    monkeypatch.setattr(auth_cache_sync, 'check_interval', 3600)
+    statements = []
+    with app.app_context():
+        engine = db.engine
+
+    def listener(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        assert client.get('/api/download_file', headers=headers).status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert statements == []
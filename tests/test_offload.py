@@ -0,0 +1,70 @@
+import io
+import os
+
+import pytest
+
+from src.utils.blob_store import BlobStore
+from src.utils.ranged_file import send_offloaded_file
+
+CONTENT = b'offloaded download ' * 1000
+
+
+@pytest.fixture(scope='module')
+def download(app):
+    """上传测试文件，返回(下载地址, 内容寻址存储中的文件路径)"""
+    client = app.test_client()
+    response = client.post('/admin/api/upload', data={'file': (io.BytesIO(CONTENT), 'offload.zip')})
+    upload = response.get_json()
+    code = client.post('/api/generate_cdk', json={'count': 1, 'file_ids': [upload['file_id']]}).get_json()['cdks'][0]
+    result = client.post('/api/verify_cdk', json={'cdk': code, 'device_id': 'offload-device'}).get_json()
+    blob_path = BlobStore(app.config['FILES_DIR']).blob_path(upload['sha256'])
+    return result['files'][0]['download_url'], blob_path
+
+
+@pytest.fixture
+def offload(app, monkeypatch):
+    def set_mode(mode):
+        monkeypatch.setitem(app.config, 'DOWNLOAD_OFFLOAD', mode)
+    return set_mode
+
+
+def test_direct_sends_body(client, download, offload):
+    offload('direct')
+    response = client.get(download[0])
+    assert response.status_code == 200
+    assert 'X-Accel-Redirect' not in response.headers
+    assert 'X-Sendfile' not in response.headers
+    assert response.get_data() == CONTENT
+
+
+def test_x_accel_redirects_to_blob(client, download, offload, files_dir):
+    offload('x-accel')
+    url, blob_path = download
+    response = client.get(url)
+    relative = os.path.relpath(blob_path, files_dir).replace(os.sep, '/')
+    assert relative.startswith('.blobs/')
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == '/protected-files/' + relative
+    assert 'attachment' in response.headers['Content-Disposition']
+    assert 'offload.zip' in response.headers['Content-Disposition']
+    assert response.get_data() == b''
+
+
+def test_x_sendfile_points_to_blob(client, download, offload):
+    offload('x-sendfile')
+    url, blob_path = download
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['X-Sendfile'] == os.path.abspath(blob_path)
+    assert response.get_data() == b''
+
+
+@pytest.mark.parametrize('mode', ['x-accel', 'x-sendfile'])
+def test_rejects_paths_outside_files_dir(files_dir, tmp_path, mode):
+    outside = tmp_path / 'secret.zip'
+    outside.write_bytes(b'secret')
+    # 名称以下载目录开头的同级目录也不在下载目录中
+    sibling = files_dir.rstrip(os.sep) + '-other'
+    for path in (str(outside), os.path.join(files_dir, '..', 'app.db'), os.path.join(sibling, 'a.zip'), files_dir):
+        with pytest.raises(ValueError):
+            send_offloaded_file(path, 'secret.zip', None, mode, files_dir, '/protected-files/')
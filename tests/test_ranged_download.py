@@ -0,0 +1,98 @@
+import io
+import re
+
+import pytest
+
+FILE_SIZE = 100000
+
+
+@pytest.fixture(scope='module')
+def content():
+    return bytes(i % 251 for i in range(FILE_SIZE))
+
+
+@pytest.fixture(scope='module')
+def download_url(app, content):
+    """上传测试文件，返回授权该文件的CDK所签发的下载地址"""
+    client = app.test_client()
+    response = client.post('/admin/api/upload', data={'file': (io.BytesIO(content), 'ranged.zip')})
+    file_id = response.get_json()['file_id']
+    code = client.post('/api/generate_cdk', json={'count': 1, 'file_ids': [file_id]}).get_json()['cdks'][0]
+    result = client.post('/api/verify_cdk', json={'cdk': code, 'device_id': 'ranged-device'}).get_json()
+    return result['files'][0]['download_url']
+
+
+def _parse_byteranges(response):
+    """解析multipart/byteranges响应，返回[(Content-Range, 内容)]"""
+    boundary = re.search(r'boundary=(\S+)', response.headers['Content-Type']).group(1).encode()
+    parts = []
+    for part in response.get_data().split(b'--' + boundary)[1:]:
+        if part.startswith(b'--'):
+            break
+        headers, body = part.split(b'\r\n\r\n', 1)
+        content_range = re.search(rb'Content-Range: (.+)', headers).group(1).decode().strip()
+        parts.append((content_range, body[:-2]))
+    return parts
+
+
+def test_full_download(client, download_url, content):
+    response = client.get(download_url)
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.get_data() == content
+
+
+def test_single_range(client, download_url, content):
+    response = client.get(download_url, headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{FILE_SIZE}'
+    assert response.content_length == 100
+    assert response.get_data() == content[100:200]
+
+
+def test_suffix_range(client, download_url, content):
+    response = client.get(download_url, headers={'Range': 'bytes=-500'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes {FILE_SIZE - 500}-{FILE_SIZE - 1}/{FILE_SIZE}'
+    assert response.get_data() == content[-500:]
+
+
+def test_multiple_ranges(client, download_url, content):
+    response = client.get(download_url, headers={'Range': 'bytes=0-9,1000-1099,-10'})
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    assert response.content_length == len(response.get_data())
+    assert _parse_byteranges(response) == [
+        (f'bytes 0-9/{FILE_SIZE}', content[:10]),
+        (f'bytes 1000-1099/{FILE_SIZE}', content[1000:1100]),
+        (f'bytes {FILE_SIZE - 10}-{FILE_SIZE - 1}/{FILE_SIZE}', content[-10:]),
+    ]
+
+
+def test_if_range_matching_etag(client, download_url, content):
+    etag = client.get(download_url).headers['ETag']
+    response = client.get(download_url, headers={'Range': 'bytes=0-99', 'If-Range': etag})
+    assert response.status_code == 206
+    assert response.get_data() == content[:100]
+
+
+def test_if_range_mismatch_returns_full_file(client, download_url, content):
+    response = client.get(download_url, headers={'Range': 'bytes=0-99', 'If-Range': '"stale-etag"'})
+    assert response.status_code == 200
+    assert 'Content-Range' not in response.headers
+    assert response.get_data() == content
+
+
+def test_unsatisfiable_range(client, download_url):
+    response = client.get(download_url, headers={'Range': f'bytes={FILE_SIZE}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{FILE_SIZE}'
+
+
+def test_resume_from_two_ranges(client, download_url, content):
+    first = client.get(download_url, headers={'Range': 'bytes=0-39999'})
+    etag = first.headers['ETag']
+    second = client.get(download_url, headers={'Range': 'bytes=40000-', 'If-Range': etag})
+    assert (first.status_code, second.status_code) == (206, 206)
+    assert second.headers['Content-Range'] == f'bytes 40000-{FILE_SIZE - 1}/{FILE_SIZE}'
+    assert first.get_data() + second.get_data() == content
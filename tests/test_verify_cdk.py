@@ -0,0 +1,49 @@
+import threading
+
+from src.models.cdk import REDEEM_MESSAGES, REDEEM_WRONG_DEVICE
+
+# 同时兑换同一个CDK的线程数
+CONCURRENT_REDEEMS = 200
+
+
+def test_verify_binds_device(client, make_cdks):
+    code = make_cdks()[0]
+
+    response = client.post('/api/verify_cdk', json={'cdk': code, 'device_id': 'device-a'})
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'success'
+
+    # 同一设备再次验证成功，其他设备失败
+    assert client.post('/api/verify_cdk', json={'cdk': code, 'device_id': 'device-a'}).status_code == 200
+    response = client.post('/api/verify_cdk', json={'cdk': code, 'device_id': 'device-b'})
+    assert response.status_code == 400
+    assert response.get_json()['message'] == REDEEM_MESSAGES[REDEEM_WRONG_DEVICE]
+
+
+def test_concurrent_verify_has_exactly_one_winner(app, make_cdks):
+    code = make_cdks()[0]
+    barrier = threading.Barrier(CONCURRENT_REDEEMS)
+    results = [None] * CONCURRENT_REDEEMS
+
+    def redeem(index):
+        client = app.test_client()
+        barrier.wait()
+        response = client.post('/api/verify_cdk', json={'cdk': code, 'device_id': f'device-{index}'})
+        results[index] = (response.status_code, response.get_json()['message'])
+
+    threads = [threading.Thread(target=redeem, args=(i,)) for i in range(CONCURRENT_REDEEMS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [i for i, (status, _) in enumerate(results) if status == 200]
+    assert len(winners) == 1
+    losers = [result for i, result in enumerate(results) if i != winners[0]]
+    assert losers == [(400, REDEEM_MESSAGES[REDEEM_WRONG_DEVICE])] * (CONCURRENT_REDEEMS - 1)
+
+    # 只有胜出的设备获得授权
+    client = app.test_client()
+    for index in (winners[0], (winners[0] + 1) % CONCURRENT_REDEEMS):
+        response = client.post('/api/check_device', json={'device_id': f'device-{index}'})
+        assert response.get_json()['authorized'] == (index == winners[0])